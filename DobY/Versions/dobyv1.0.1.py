@@ -1,7 +1,6 @@
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import pdfplumber
-import pandas as pd
 import re
 import os
 import logging
@@ -24,11 +23,18 @@ def extract_text_from_pdf(file_path):
         logging.error(f"Error extracting text from {file_path}: {e}")
     return text_list
 
-#Add extracted text to dataframe
-def pdf_to_dataframe(file_path):
-    text_list = extract_text_from_pdf(file_path)
-    df = pd.DataFrame(text_list, columns=["Text"])
-    return df
+# The text of every page, joined once the first time a matcher asks for it and then shared by all of them
+class PdfText:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            # Pages without text are left out, the way the DataFrame's str.cat did
+            self._text = " ".join(text for text in extract_text_from_pdf(self.file_path) if text is not None)
+        return self._text
 
 def extract_info_and_save(file_paths, progress_label, summary_label):
     renamed_count = 0  # Counter for renamed files
@@ -83,13 +89,12 @@ def extract_info_and_save(file_paths, progress_label, summary_label):
 
     for file_path in file_paths:
         try:
-            # Convert PDF to DataFrame
-            df = pdf_to_dataframe(file_path)
+            pdf_text = PdfText(file_path)
             # Extract invoice number
             prefix_match = None
             for prefix in company_prefixes.keys():
                 prefix_pattern = rf"\b{prefix}\d{{6}}\b"
-                prefix_match = re.search(prefix_pattern, df['Text'].str.cat(sep=' '))
+                prefix_match = re.search(prefix_pattern, pdf_text.text)
                 if prefix_match:
                     company_prefix = prefix
                     break
@@ -103,7 +108,7 @@ def extract_info_and_save(file_paths, progress_label, summary_label):
 
             client_match = None
             for client, pattern in client_patterns.items():
-                client_match = re.search(pattern, df['Text'].str.cat(sep=' '), re.IGNORECASE)
+                client_match = re.search(pattern, pdf_text.text, re.IGNORECASE)
                 if client_match:
                     client_string = client_match.group(0)
                     break
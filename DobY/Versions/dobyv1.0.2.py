@@ -1,18 +1,99 @@
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
 import pdfplumber
-import pandas as pd
 import re
 import os
+import sys
+import errno
 import logging
-import shutil
+import queue
+import threading
 from datetime import datetime
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PyPDF2 import PdfMerger
 
 # Error Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# How originals are stored in the dated archive. PDFs are already compressed, so
+# zipfile.ZIP_STORED is much quicker and the archive comes out barely bigger
+ARCHIVE_COMPRESSION = zipfile.ZIP_DEFLATED
+ARCHIVE_QUEUE_SIZE = 64 # Originals waiting for the archive thread
+COPY_CHUNK_SIZE = 1024 * 1024 # Bytes moved per call when copying, so memory stays flat however big the PDF
+# Errors that mean the kernel can't copy between these two files, so the next way of copying is tried
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF}
+
+# Copy src_path to dst_path without reading the whole file into memory. The kernel moves the bytes
+# itself where it can (copy_file_range, then sendfile), otherwise they go through one reused buffer
+def copy_file(src_path, dst_path):
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        kernel_copies = []
+        if hasattr(os, "copy_file_range"):
+            kernel_copies.append(lambda: os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE))
+        if hasattr(os, "sendfile") and sys.platform.startswith("linux"):
+            kernel_copies.append(lambda: os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE))
+        for kernel_copy in kernel_copies:
+            copied = 0
+            try:
+                while True:
+                    sent = kernel_copy()
+                    if not sent:
+                        return
+                    copied += sent
+            except OSError as e:
+                if copied or e.errno not in KERNEL_COPY_UNSUPPORTED:
+                    raise
+
+        buffer = bytearray(COPY_CHUNK_SIZE)
+        view = memoryview(buffer)
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                return
+            dst.write(view[:read])
+
+# Streams originals into a zip archive on a background thread as each one is handed over,
+# so compressing them overlaps with reading the next PDFs
+class ArchiveWriter:
+    def __init__(self, archive_path, compression=ARCHIVE_COMPRESSION):
+        self.archive_path = archive_path
+        # Written under a temporary name, so a crash never leaves a cut-off archive behind
+        self.temp_archive_path = f"{archive_path}.tmp"
+        self.archive = zipfile.ZipFile(self.temp_archive_path, 'w', compression=compression)
+        self.files = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+        self.archived_files = []
+        self.thread = threading.Thread(target=self.write_files, daemon=True)
+        self.thread.start()
+
+    def add(self, file_path):
+        self.files.put(file_path)
+
+    def write_files(self):
+        while True:
+            file_path = self.files.get()
+            if file_path is None:
+                return
+            try:
+                self.archive.write(file_path, os.path.basename(file_path))
+                self.archived_files.append(file_path)
+            except Exception as e:
+                logging.error(f"Error archiving {file_path}: {e}")
+
+    # Add the summary, finish the archive and give it its real name. Returns the files now safely in it
+    def close(self, summary_name, summary_text):
+        self.files.put(None)
+        self.thread.join()
+        try:
+            self.archive.writestr(summary_name, summary_text)
+            self.archive.close()
+            os.replace(self.temp_archive_path, self.archive_path)
+        except Exception as e:
+            logging.error(f"Error finishing archive {self.archive_path}: {e}")
+            return []
+        return self.archived_files
+
 # Extract text from PDF files
 def extract_text_from_pdf(file_path):
     text_list = []
@@ -25,13 +106,20 @@ def extract_text_from_pdf(file_path):
         logging.error(f"Error extracting text from {file_path}: {e}")
     return text_list
 
-# Add extracted text to dataframe
-def pdf_to_dataframe(file_path):
-    text_list = extract_text_from_pdf(file_path)
-    df = pd.DataFrame(text_list, columns=["Text"])
-    return df
+# The text of every page, joined once the first time a matcher asks for it and then shared by all of them
+class PdfText:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            # Pages without text are left out, the way the DataFrame's str.cat did
+            self._text = " ".join(text for text in extract_text_from_pdf(self.file_path) if text is not None)
+        return self._text
 
-def extract_info_and_save(file_paths, progress_label, summary_label, move_to_reload=False):
+def extract_info_and_save(file_paths, progress_label, summary_label, move_to_reload=False, archive_compression=ARCHIVE_COMPRESSION):
     renamed_count = 0  # Counter for renamed files
     total_files = len(file_paths)  # Total number of files to be renamed
     not_renamed_files = []  # List to store files that were not renamed
@@ -81,15 +169,19 @@ def extract_info_and_save(file_paths, progress_label, summary_label, move_to_rel
     if not os.path.exists(invoices_folder_path):
         os.makedirs(invoices_folder_path)
 
+    # Originals go straight into a dated zip archive as each one is done with
+    archive_name = f"Archive - {datetime.now().strftime('%Y-%m-%d')}.zip"
+    archive_path = os.path.join(invoices_folder_path, archive_name)
+    archive = ArchiveWriter(archive_path, archive_compression)
+
     for file_path in file_paths:
         try:
-            # Convert PDF to DataFrame
-            df = pdf_to_dataframe(file_path)
+            pdf_text = PdfText(file_path)
             # Extract invoice number
             prefix_match = None
             for prefix in company_prefixes.keys():
                 prefix_pattern = rf"\b{prefix}\d{{6}}\b"
-                prefix_match = re.search(prefix_pattern, df['Text'].str.cat(sep=' '))
+                prefix_match = re.search(prefix_pattern, pdf_text.text)
                 if prefix_match:
                     company_prefix = prefix
                     break
@@ -103,7 +195,7 @@ def extract_info_and_save(file_paths, progress_label, summary_label, move_to_rel
 
             client_match = None
             for client, pattern in client_patterns.items():
-                client_match = re.search(pattern, df['Text'].str.cat(sep=' '), re.IGNORECASE)
+                client_match = re.search(pattern, pdf_text.text, re.IGNORECASE)
                 if client_match:
                     client_string = client_match.group(0)
                     break
@@ -134,9 +226,7 @@ def extract_info_and_save(file_paths, progress_label, summary_label, move_to_rel
             new_file_name = f"{client} - {company_prefixes[company_prefix]} - {invoice_number} - {manifest_string}.pdf"
             new_file_path = os.path.join(company_folder_path, new_file_name)
 
-            with open(file_path, "rb") as original_pdf:
-                with open(new_file_path, "wb") as new_pdf:
-                    new_pdf.write(original_pdf.read())
+            copy_file(file_path, new_file_path)
 
             logging.info(f"PDF saved as: {new_file_path}")
             renamed_count += 1
@@ -153,38 +243,22 @@ def extract_info_and_save(file_paths, progress_label, summary_label, move_to_rel
             logging.error(f"An error occurred with file {file_path}: {e}")
             not_renamed_files.append((file_path, str(e)))
 
-    # Move original PDFs to 'Original Invoices' folder inside 'Invoices' folder and create a zip archive
-    original_invoices_folder_path = os.path.join(invoices_folder_path, 'Original Invoices')
-    if not os.path.exists(original_invoices_folder_path):
-        os.makedirs(original_invoices_folder_path)
+        finally:
+            archive.add(file_path)
 
-    for file_path in file_paths:
-        shutil.move(file_path, original_invoices_folder_path)
+    # Generate the summary and write it into the archive
+    summary_lines = ["Renaming Summary", "================", "", "Renamed Files:"]
+    for original_name, new_name in renamed_files_info:
+        summary_lines.append(f"{original_name} -> {new_name}")
 
-    # Create a zip archive of the 'Original Invoices' folder
-    archive_name = f"Archive - {datetime.now().strftime('%Y-%m-%d')}.zip"
-    archive_path = os.path.join(invoices_folder_path, archive_name)
-    shutil.make_archive(os.path.splitext(archive_path)[0], 'zip', original_invoices_folder_path)
-
-    # Generate summary text document in the original folder and move it to the archive folder
-    summary_file_path = os.path.join(original_invoices_folder_path, 'renaming_summary.txt')
-    with open(summary_file_path, 'w') as summary_file:
-        summary_file.write("Renaming Summary\n")
-        summary_file.write("================\n\n")
-        summary_file.write("Renamed Files:\n")
-        for original_name, new_name in renamed_files_info:
-            summary_file.write(f"{original_name} -> {new_name}\n")
-        
-        summary_file.write("\nNot Renamed Files:\n")
-        for file_path, reason in not_renamed_files:
-            summary_file.write(f"{os.path.basename(file_path)}: {reason}\n")
-
-    # Add the summary file to the archive
-    with zipfile.ZipFile(archive_path, 'a') as archive:
-        archive.write(summary_file_path, os.path.basename(summary_file_path))
-
-    # Delete the 'Original Invoices' folder after creating the archive
-    shutil.rmtree(original_invoices_folder_path)
+    summary_lines += ["", "Not Renamed Files:"]
+    for file_path, reason in not_renamed_files:
+        summary_lines.append(f"{os.path.basename(file_path)}: {reason}")
+    archived_files = archive.close('renaming_summary.txt', "\n".join(summary_lines) + "\n")
+
+    # The originals are only deleted once the archive holding them is complete
+    for file_path in archived_files:
+        os.remove(file_path)
 
     # Show the total number of files renamed and clear progress label after user clicks OK
     messagebox.showinfo("Summary", f"Total number of files renamed: {renamed_count}")
@@ -211,99 +285,143 @@ def process_pdfs(progress_label):
 def rename_and_save_files(file_paths, progress_label, summary_label, move_to_reload=False):
     extract_info_and_save(file_paths, progress_label, summary_label, move_to_reload)
 
+# Put the schedule in front of the invoice. Runs in a worker process
+def merge_with_schedule(invoice_file, schedule_file):
+    # Write the merge next to the invoice first, so a failed merge never leaves half an invoice behind
+    temp_file_path = f"{invoice_file}.{os.getpid()}.tmp"
+    merger = PdfMerger()
+    try:
+        merger.append(schedule_file)
+        merger.append(invoice_file)
+        merger.write(temp_file_path)
+        merger.close()
+        os.replace(temp_file_path, invoice_file)
+    except Exception:
+        merger.close()
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+        raise
+    return invoice_file
+
 def merge_pdfs(invoice_folder, schedule_folder, progress_label):
     invoice_files = [os.path.join(invoice_folder, file) for file in os.listdir(invoice_folder) if file.lower().endswith('.pdf')]
     schedule_files = [os.path.join(schedule_folder, file) for file in os.listdir(schedule_folder) if file.lower().endswith('.pdf')]
 
+    # Each client string is looked up in the schedule names once, however many invoices share it
+    schedule_by_client = {}
+    merges = []
     for invoice_file in invoice_files:
         invoice_name = os.path.basename(invoice_file)
-        client_string = re.search(r" - (.*?) - ", invoice_name).group(1)
-        matching_schedule = next((file for file in schedule_files if client_string in os.path.basename(file)), None)
+        client_match = re.search(r" - (.*?) - ", invoice_name)
+        if not client_match:
+            logging.error(f"Could not find the client string in the file name: {invoice_file}")
+            continue
+        client_string = client_match.group(1)
+        if client_string not in schedule_by_client:
+            schedule_by_client[client_string] = next((file for file in schedule_files if client_string in os.path.basename(file)), None)
+        matching_schedule = schedule_by_client[client_string]
 
         if matching_schedule:
-            merger = PdfMerger()
-            merger.append(matching_schedule)
-            merger.append(invoice_file)
-            merged_file_path = os.path.join(invoice_folder, invoice_name)
-            merger.write(merged_file_path)
-            merger.close()
-            logging.info(f"Merged PDF saved as: {merged_file_path}")
-
-    messagebox.showinfo("Merge Complete", "PDFs have been merged successfully.")
+            merges.append((invoice_file, matching_schedule))
+
+    # Merge in parallel, one worker process per CPU
+    merged_count = 0
+    failed_files = []
+    if merges:
+        with ProcessPoolExecutor(max_workers=min(len(merges), os.cpu_count() or 1)) as executor:
+            futures = {executor.submit(merge_with_schedule, invoice_file, schedule_file): invoice_file for invoice_file, schedule_file in merges}
+            for future in as_completed(futures):
+                merged_file_path = futures[future]
+                try:
+                    future.result()
+                    merged_count += 1
+                    logging.info(f"Merged PDF saved as: {merged_file_path}")
+                except Exception as e:
+                    logging.error(f"Error merging {merged_file_path}: {e}")
+                    failed_files.append(merged_file_path)
+                progress_label.configure(text=f"{merged_count} of {len(merges)} files merged")
+                root.update_idletasks()
+
+    if failed_files:
+        messagebox.showwarning("Merge Complete", f"{merged_count} PDFs merged, {len(failed_files)} could not be merged. See the log for details.")
+    else:
+        messagebox.showinfo("Merge Complete", "PDFs have been merged successfully.")
     progress_label.configure(text="")
 
-# Create the main customtkinter window
-ctk.set_appearance_mode("dark")
-ctk.set_default_color_theme("dark-blue")
-
-root = ctk.CTk()
-root.title("Doby!")
-root.geometry("270x400")
-
-# Set the icon of the application
-root.iconbitmap('doby.png')
-
-# Initialize variables to store file paths
-file_paths = []
-
-# Add an Upload Files button to trigger the operation for selecting files
-def upload_files():
-    global file_paths
-    file_paths = process_pdfs(progress_label)
-    if file_paths:
-        files_found_label.configure(text=f"Files Found: {len(file_paths)}")
-        files_found_label.place(relx=0.5, rely=0.9, anchor='s')
-        progress_label.configure(text="")  # Clear the progress label
-
-upload_button = ctk.CTkButton(root, text="Upload Files", command=upload_files)
-upload_button.pack(pady=10)
-
-# Add a label to show the number of files found underneath the GO button
-files_found_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
-files_found_label.place_forget()
-
-# Add a label to show progress at the bottom center portion of the UI
-progress_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
-progress_label.place(relx=0.5, rely=1.0, anchor='s')
-
-# Add a label to show the summary of the renaming process
-summary_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
-summary_label.pack(pady=10)
-
-# Add a GO! button to trigger renaming and saving files
-def go_button_click():
-    rename_and_save_files(file_paths, progress_label, summary_label)
-    files_found_label.place(relx=0.5, rely=0.95, anchor='s')
-
-go_button = ctk.CTkButton(root, text="GO!", command=go_button_click)
-go_button.pack(pady=10)
-
-# Add checkboxes for Nickel, Anodes, and Cathodes
-nickel_var = ctk.BooleanVar()
-anodes_var = ctk.BooleanVar()
-cathodes_var = ctk.BooleanVar()
-
-nickel_checkbox = ctk.CTkCheckBox(root, text="Nickel", variable=nickel_var)
-nickel_checkbox.pack(pady=5)
-anodes_checkbox = ctk.CTkCheckBox(root, text="Anodes", variable=anodes_var)
-anodes_checkbox.pack(pady=5)
-cathodes_checkbox = ctk.CTkCheckBox(root, text="Cathodes", variable=cathodes_var)
-cathodes_checkbox.pack(pady=5)
-
-# Add a Merge PDFs button
-def merge_pdfs_button_click():
-    if nickel_var.get():
-        invoice_folder = filedialog.askdirectory(title="Select Folder Containing Invoices")
-        if not invoice_folder:
-            return
-        rename_and_save_files(process_pdfs(progress_label), progress_label, summary_label, move_to_reload=True)
-        schedule_folder = filedialog.askdirectory(title="Select Folder Containing Schedules")
-        if not schedule_folder:
-            return
-        merge_pdfs(invoice_folder, schedule_folder, progress_label)
-
-merge_pdfs_button = ctk.CTkButton(root, text="Merge PDFs", command=merge_pdfs_button_click)
-merge_pdfs_button.pack(pady=10)
-
-# Run the customtkinter event loop
-root.mainloop()
\ No newline at end of file
+# The window is only built when this file is run, not when the merge workers import it
+if __name__ == "__main__":
+    # Create the main customtkinter window
+    ctk.set_appearance_mode("dark")
+    ctk.set_default_color_theme("dark-blue")
+
+    root = ctk.CTk()
+    root.title("Doby!")
+    root.geometry("270x400")
+
+    # Set the icon of the application
+    root.iconbitmap('doby.png')
+
+    # Initialize variables to store file paths
+    file_paths = []
+
+    # Add an Upload Files button to trigger the operation for selecting files
+    def upload_files():
+        global file_paths
+        file_paths = process_pdfs(progress_label)
+        if file_paths:
+            files_found_label.configure(text=f"Files Found: {len(file_paths)}")
+            files_found_label.place(relx=0.5, rely=0.9, anchor='s')
+            progress_label.configure(text="")  # Clear the progress label
+
+    upload_button = ctk.CTkButton(root, text="Upload Files", command=upload_files)
+    upload_button.pack(pady=10)
+
+    # Add a label to show the number of files found underneath the GO button
+    files_found_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
+    files_found_label.place_forget()
+
+    # Add a label to show progress at the bottom center portion of the UI
+    progress_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
+    progress_label.place(relx=0.5, rely=1.0, anchor='s')
+
+    # Add a label to show the summary of the renaming process
+    summary_label = ctk.CTkLabel(root, text="", text_color="light grey", font=("Arial", 12))
+    summary_label.pack(pady=10)
+
+    # Add a GO! button to trigger renaming and saving files
+    def go_button_click():
+        rename_and_save_files(file_paths, progress_label, summary_label)
+        files_found_label.place(relx=0.5, rely=0.95, anchor='s')
+
+    go_button = ctk.CTkButton(root, text="GO!", command=go_button_click)
+    go_button.pack(pady=10)
+
+    # Add checkboxes for Nickel, Anodes, and Cathodes
+    nickel_var = ctk.BooleanVar()
+    anodes_var = ctk.BooleanVar()
+    cathodes_var = ctk.BooleanVar()
+
+    nickel_checkbox = ctk.CTkCheckBox(root, text="Nickel", variable=nickel_var)
+    nickel_checkbox.pack(pady=5)
+    anodes_checkbox = ctk.CTkCheckBox(root, text="Anodes", variable=anodes_var)
+    anodes_checkbox.pack(pady=5)
+    cathodes_checkbox = ctk.CTkCheckBox(root, text="Cathodes", variable=cathodes_var)
+    cathodes_checkbox.pack(pady=5)
+
+    # Add a Merge PDFs button
+    def merge_pdfs_button_click():
+        if nickel_var.get():
+            invoice_folder = filedialog.askdirectory(title="Select Folder Containing Invoices")
+            if not invoice_folder:
+                return
+            rename_and_save_files(process_pdfs(progress_label), progress_label, summary_label, move_to_reload=True)
+            schedule_folder = filedialog.askdirectory(title="Select Folder Containing Schedules")
+            if not schedule_folder:
+                return
+            merge_pdfs(invoice_folder, schedule_folder, progress_label)
+
+    merge_pdfs_button = ctk.CTkButton(root, text="Merge PDFs", command=merge_pdfs_button_click)
+    merge_pdfs_button.pack(pady=10)
+
+    # Run the customtkinter event loop
+    root.mainloop()
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""Cost of finding the sender as the sender list grows: regex alternation vs Aho-Corasick.
+
+Each SenderMatcher implementation searches one invoice page for a sender
+that only appears at the end, so the whole page is scanned. The regex is
+what RULES used before the automaton; "pyahocorasick" only runs when that
+package is installed.
+
+Run from the DobY folder:
+    python benchmarks/bench_matchers.py
+    python benchmarks/bench_matchers.py --senders 10,100,1000,10000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doby_core import SenderMatcher, ahocorasick
+
+WORDS = (
+    "COPPER", "ZONE", "HEADLAND", "VECTURA", "JUMARAS", "ADVANCE", "NEXGISTIX", "WAVELENGTHS", "CANCAM",
+    "LOGISTICS", "TRANSPORT", "CARRIERS", "HAULAGE", "FREIGHT", "MINING", "SUPPLIES", "KATANGA", "KITWE",
+)
+
+
+def make_sender_names(count, seed=1):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = [rng.choice(WORDS) + rng.choice("ABCDEFGHKLMNPRSTVWXYZ") * rng.randint(0, 2) for _ in range(rng.randint(1, 3))]
+        names.add(" ".join(words) + rng.choice((" LIMITED", " LTD", " ZAMBIA LIMITED")))
+    return sorted(names)
+
+
+def make_page(sender):
+    line_items = "".join(f"{i:>4}  Haulage Kolwezi - Dar es Salaam, truck {400 + i}   1  USD 2,450.00\n" for i in range(45))
+    return ("Plot 4412, Freedom Way, Kitwe, Zambia\nTAX INVOICE\nOur Ref Num: NE105332\nCMOC - MANIFEST 104233\n"
+            + line_items + sender + "\n").lower()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sender matching against the number of senders.")
+    parser.add_argument("--senders", default="10,100,1000,5000", help="comma separated sender list sizes")
+    args = parser.parse_args()
+
+    implementations = [name for name in SenderMatcher.IMPLEMENTATIONS if name != "pyahocorasick" or ahocorasick]
+    if ahocorasick is None:
+        print("pyahocorasick is not installed, skipping it\n")
+    print(f"{'senders':>8}{'matcher':>15}{'build (ms)':>12}{'per page (us)':>15}")
+    for count in (int(size) for size in args.senders.split(",")):
+        names = make_sender_names(count)
+        sender = names[count // 2]
+        page = make_page(sender)
+        for implementation in implementations:
+            started = time.perf_counter()
+            matcher = SenderMatcher(names, implementation)
+            build = time.perf_counter() - started
+            start, end = matcher.find(page)
+            assert page[start:end] == sender.lower(), (implementation, page[start:end])
+            runs = max(5, 2000 // count) if implementation == "regex" else 200
+            per_page = min(timeit.repeat(lambda: matcher.find(page), number=runs, repeat=3)) / runs
+            print(f"{count:>8}{implementation:>15}{build * 1000:>12.1f}{per_page * 1e6:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Per-document cost of invoice field matching: the original code vs RULES.
+
+Run from the DobY folder:
+    python benchmarks/bench_rules.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doby_core import RULES, extract_invoice_data_for_rename
+
+COMPANY_ABBREVIATIONS = RULES.company_abbreviations
+
+
+def legacy_extract_invoice_data_for_rename(pdf_text, pdf_name, log):
+    # dobyv2.0.4 as it was before the rule engine, kept here to compare against
+    known_senders_pattern = r"(" + "|".join(re.escape(name) for name in COMPANY_ABBREVIATIONS.keys()) + r")"
+    data = {}
+    match = re.search(known_senders_pattern, pdf_text, re.IGNORECASE)
+    if not match:
+        log(f"Could not find a known sender company name in {pdf_name}.")
+        return None
+    found_name_in_pdf = match.group(1)
+    for key_from_dict in COMPANY_ABBREVIATIONS.keys():
+        if key_from_dict.lower() == found_name_in_pdf.lower():
+            data["company_code"] = COMPANY_ABBREVIATIONS[key_from_dict]
+            break
+    client_manifest_patterns = {
+        "CMOC": r"CMOC - MANIFEST\s*(\d+)",
+        "TFM": r"TFM - MANIFEST\s*(\d+)",
+        "IXM": r"IXM - MANIFEST\s*(\d+)",
+        "MET": r"MET \s*(\d+)"
+    }
+    for client_name, pattern in client_manifest_patterns.items():
+        manifest_num_match = re.search(pattern, pdf_text, re.IGNORECASE)
+        if manifest_num_match:
+            data["client_for_naming"] = client_name
+            data["manifest_num"] = manifest_num_match.group(1)
+            log(f"Detected client '{client_name}' and Manifest No. '{data['manifest_num']}' for {pdf_name}.")
+            break
+    else:
+        log(f"Could not detect a client (CMOC, TFM, MET or IXM) based on manifest patterns in {pdf_name}.")
+        return None
+    our_ref_num_match = re.search(r"Our Ref Num:\s*([A-Z0-9]+)", pdf_text, re.IGNORECASE)
+    if not our_ref_num_match:
+        log(f"Could not find 'Our Ref Num:' in {pdf_name}.")
+        return None
+    data["our_ref_num"] = our_ref_num_match.group(1)
+    return data
+
+
+def make_invoice_text(pages, client_line, our_ref_num="NE105332"):
+    header = (
+        "NEXGISTIX LIMITED\nPlot 123, Kitwe, Zambia\nTAX INVOICE\n"
+        f"Our Ref Num: {our_ref_num}\n{client_line}\n"
+    )
+    line_items = "".join(f"{i:>4}  Freight Kitwe - Kolwezi   1  USD 2,450.00\n" for i in range(45))
+    return header + line_items + "\n" + (line_items + "\n") * (pages - 1)
+
+
+def main():
+    cases = [
+        ("1 page, CMOC", make_invoice_text(1, "CMOC - MANIFEST 104233")),
+        ("1 page, MET", make_invoice_text(1, "MET 88120")),
+        ("10 pages, TFM", make_invoice_text(10, "TFM - MANIFEST 55102")),
+        ("40 pages, MET", make_invoice_text(40, "MET 88120")),
+        ("40 pages, no client", make_invoice_text(40, "")),
+        # A ref num that is also a MET manifest, alone and behind a client that comes first
+        ("1 page, MET in ref", make_invoice_text(1, "", our_ref_num="MET 12345")),
+        ("1 page, MET ref, CMOC", make_invoice_text(1, "CMOC - MANIFEST 104233", our_ref_num="MET 12345")),
+    ]
+    ignore_log = lambda message: None
+    print(f"{'document':<22}{'original (us)':>15}{'rule engine (us)':>18}{'speed-up':>10}")
+    for label, text in cases:
+        assert (legacy_extract_invoice_data_for_rename(text, "x.pdf", ignore_log)
+                == extract_invoice_data_for_rename(text, "x.pdf", ignore_log))
+        runs = 200
+        legacy = min(timeit.repeat(lambda: legacy_extract_invoice_data_for_rename(text, "x.pdf", ignore_log), number=runs, repeat=3))
+        engine = min(timeit.repeat(lambda: extract_invoice_data_for_rename(text, "x.pdf", ignore_log), number=runs, repeat=3))
+        print(f"{label:<22}{legacy / runs * 1e6:>15.1f}{engine / runs * 1e6:>18.1f}{legacy / engine:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Cost of matching v1's company prefixes and client patterns: pandas DataFrame vs a text joined once.
+
+Versions/dobyv1.0.x used to put each page's text in a DataFrame and call
+df['Text'].str.cat(sep=' ') again for every prefix and client pattern it
+tried, up to 30 joins per file. PdfText joins the pages once and every
+pattern searches that one string. Both loops below are the v1 loop with
+its prefix and client tables, run on page texts from synthetic_invoices,
+so no PDF library is involved; "joining ms/file" is the time spent
+building the DataFrame and joining its pages. "dataframe" only runs when
+pandas is installed.
+
+The second table is v2's "header" text mode on real invoices, by default
+the samples in Invoices/. It reads each first page with pdfium whole, then
+only the text_regions in the rules file: the default regions, and the
+sender's own template when the rules file has one for it. "same fields"
+checks that header mode finds what full mode does. Region reads cost
+more than whole-page reads with pdfium, which builds the page's whole
+text either way, so header mode is about where fields are looked for,
+not speed.
+
+Run from the DobY folder:
+    python benchmarks/bench_text_view.py
+    python benchmarks/bench_text_view.py -n 500 --pages 1,5,20
+    python benchmarks/bench_text_view.py --pdfs "C:\\Invoices\\May"
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doby_core import RULES, TEXT_BACKENDS, read_invoice_fields
+from synthetic_invoices import invoice_pages
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+# The tables in Versions/dobyv1.0.2.py
+COMPANY_PREFIXES = ("CNC", "WA", "NE", "IN", "JU", "CA", "ZI", "HL", "IC", "VE")
+CLIENT_PATTERNS = (
+    r"CMOC\s*-\s*MANIFEST\s*\d+|CMoC\s*-\s*Manifest\s*\d+|CMOC\s*-\s*Manifest\s*\d+",
+    r"4S\s*Structures\s*-\s*MANIFEST\s*\d+",
+    r"Breakdown\s*-\s*MANIFEST\s*\d+",
+    r"Polytra\s*-\s*MANIFEST\s*\d+",
+    r"Sonorex\s*-\s*MANIFEST\s*\d+",
+    r"IXM\s*-\s*MANIFEST\s*\d+",
+    r"TFM\s*-\s*MANIFEST\s*\d+",
+    r"Tricore\s*-\s*MANIFEST\s*\d+",
+    r"Cash\s*Sales\s*-\s*MANIFEST\s*\d+",
+    r"KML\s*-\s*MANIFEST\s*\d+",
+    r"KFM\s*-\s*MANIFEST\s*\d+|KFM\s*-\s*Manifest\s*\d+|KFM\s*-\s*Manifest\s*\d+",
+    r"Loanstock\s*-\s*MANIFEST\s*\d+",
+    r"Matvin\s*-\s*MANIFEST\s*\d+",
+    r"Reload\s*-\s*MANIFEST\s*\d+",
+    r"Venditime\s*Zambia\s*-\s*MANIFEST\s*\d+",
+    r"BRAKE\s*LINING\s*\d+",
+    r"BRITALMIN\s*\d+",
+    r"ATT\s*\d+",
+    r"VT\s*\d+",
+)
+
+
+class CountingText:
+    """The PdfText view from v1, counting how often and how long the pages get joined."""
+
+    def __init__(self, page_texts):
+        self.page_texts = page_texts
+        self.joins = 0
+        self.join_seconds = 0.0
+        self._text = None
+
+    @property
+    def text(self):
+        if self._text is None:
+            started = time.perf_counter()
+            self._text = " ".join(text for text in self.page_texts if text is not None)
+            self.join_seconds += time.perf_counter() - started
+            self.joins += 1
+        return self._text
+
+
+class CountingDataFrame:
+    """The old pdf_to_dataframe result, counting and timing every str.cat and the DataFrame itself."""
+
+    def __init__(self, page_texts):
+        started = time.perf_counter()
+        self.df = pd.DataFrame(page_texts, columns=["Text"])
+        self.join_seconds = time.perf_counter() - started
+        self.joins = 0
+
+    @property
+    def text(self):
+        started = time.perf_counter()
+        text = self.df['Text'].str.cat(sep=' ')
+        self.join_seconds += time.perf_counter() - started
+        self.joins += 1
+        return text
+
+
+def match_invoice(view):
+    """v1's matching loop, returning what it found."""
+    company_prefix = None
+    for prefix in COMPANY_PREFIXES:
+        prefix_match = re.search(rf"\b{prefix}\d{{6}}\b", view.text)
+        if prefix_match:
+            company_prefix = prefix_match.group(0)
+            break
+    if company_prefix is None:
+        return None
+    for pattern in CLIENT_PATTERNS:
+        client_match = re.search(pattern, view.text, re.IGNORECASE)
+        if client_match:
+            return company_prefix, client_match.group(0)
+    return company_prefix, None
+
+
+def make_documents(count, page_counts, seed=1):
+    rng = random.Random(seed)
+    senders = list(RULES.company_abbreviations.items())
+    clients = list(RULES.client_manifest_patterns)
+    documents = []
+    for i in range(count):
+        sender, company_code = senders[i % len(senders)]
+        client = clients[i % len(clients)]
+        pages = invoice_pages(sender, client, str(rng.randint(10000, 999999)),
+                              f"{company_code}{rng.randint(100000, 999999)}", page_counts[i % len(page_counts)], rng)
+        documents.append(["\n".join(lines) for lines in pages])
+    return documents
+
+
+def run(view_class, documents):
+    started = time.perf_counter()
+    results = []
+    joins = 0
+    join_seconds = 0.0
+    for page_texts in documents:
+        view = view_class(page_texts)
+        results.append(match_invoice(view))
+        joins += view.joins
+        join_seconds += view.join_seconds
+    return time.perf_counter() - started, joins, join_seconds, results
+
+
+def region_reads(pdf_path, runs=20):
+    """Characters and ms per read for pdf_path's whole first page, its default regions and its sender's template.
+
+    The template is None when the rules file has none for the sender.
+    """
+    backend = TEXT_BACKENDS["pdfium"]
+
+    def measure(read):
+        return len(read()), min(timeit.repeat(read, number=runs, repeat=3)) / runs * 1000
+
+    pdf_doc = backend.open(pdf_path)
+    try:
+        page = backend.open_page(pdf_doc, 0)
+        try:
+            whole = measure(lambda: backend.page_text(page))
+            regions = measure(lambda: backend.region_text(page, RULES.text_regions))
+            fields = RULES.match(backend.page_text(page))
+            company_code = RULES.company_code(fields["sender"]) if "sender" in fields else None
+            template = None
+            if company_code in RULES.sender_text_regions:
+                template = measure(lambda: backend.region_text(page, RULES.sender_text_regions[company_code]))
+        finally:
+            backend.close_page(page)
+    finally:
+        backend.close(pdf_doc)
+    return whole, regions, company_code, template
+
+
+def print_header_mode(pdf_paths):
+    print(f"{'invoice':>16}{'page chars':>12}{'page ms':>9}{'region chars':>14}{'region ms':>11}"
+          f"{'template':>10}{'tmpl chars':>12}{'same fields':>13}")
+    for pdf_path in pdf_paths:
+        (page_chars, page_ms), (region_chars, region_ms), company_code, template = region_reads(pdf_path)
+        full = read_invoice_fields(pdf_path, text_mode="full")["fields"]
+        header = read_invoice_fields(pdf_path, text_mode="header")["fields"]
+        template_name = company_code if template else "-"
+        template_chars = str(template[0]) if template else "-"
+        print(f"{os.path.basename(pdf_path)[:16]:>16}{page_chars:>12}{page_ms:>9.3f}{region_chars:>14}{region_ms:>11.3f}"
+              f"{template_name:>10}{template_chars:>12}{str(full == header):>13}")
+
+
+def pandas_import_cost():
+    """Seconds and added RSS (MB, None off Linux) of a fresh interpreter importing pandas, or None without it."""
+    code = (
+        "import os, time\n"
+        "def rss():\n"
+        "    if not os.path.exists('/proc/self/statm'):\n"
+        "        return 0\n"
+        "    with open('/proc/self/statm') as f:\n"
+        "        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')\n"
+        "before = rss()\n"
+        "started = time.perf_counter()\n"
+        "import pandas\n"
+        "print(time.perf_counter() - started, rss() - before)\n"
+    )
+    loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if loaded.returncode != 0:
+        return None
+    seconds, rss_bytes = loaded.stdout.split()
+    return float(seconds), int(rss_bytes) / 2 ** 20 if os.path.exists("/proc/self/statm") else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark v1 pattern matching on a DataFrame vs a text joined once.")
+    parser.add_argument("-n", "--count", type=int, default=300, help="number of invoices (default: 300)")
+    parser.add_argument("--pages", default="1,2,5,20", help="comma separated page counts to cycle through")
+    parser.add_argument("--pdfs", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Invoices"),
+                        help="folder of invoice PDFs for the header mode table (default: the samples in Invoices)")
+    args = parser.parse_args()
+
+    documents = make_documents(args.count, [int(pages) for pages in args.pages.split(",")])
+    views = [("text view", CountingText)]
+    if pd is None:
+        print("pandas is not installed, skipping the DataFrame\n")
+    else:
+        views.append(("dataframe", CountingDataFrame))
+
+    print(f"{'view':>10}{'seconds':>10}{'ms/file':>10}{'joins/file':>12}{'joining ms/file':>17}")
+    expected = None
+    for name, view_class in views:
+        seconds, joins, join_seconds, results = run(view_class, documents)
+        if expected is None:
+            expected = results
+        assert results == expected, f"{name} matched differently"
+        per_file = 1000 / len(documents)
+        print(f"{name:>10}{seconds:>10.3f}{seconds * per_file:>10.3f}{joins / len(documents):>12.1f}"
+              f"{join_seconds * per_file:>17.3f}")
+
+    cost = pandas_import_cost()
+    if cost is not None:
+        seconds, rss_mb = cost
+        memory = "" if rss_mb is None else f", {rss_mb:.0f} MB RSS"
+        print(f"\nimporting pandas, no longer done by v1: {seconds:.2f} s{memory}")
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdfs, "*.pdf")))
+    if pdf_paths:
+        print(f"\nheader text mode on {len(pdf_paths)} PDF(s) in {args.pdfs}, first page only\n")
+        print_header_mode(pdf_paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Throughput of DobY extraction and renaming on a synthetic corpus.
+
+Extraction is measured for each of doby_core's text backends (pdfium,
+pymupdf, pdfplumber) through process_pdf, in full and "header" text mode,
+and for the pdfplumber text extraction exactly as Versions/dobyv1.0.2.py
+did it, all feeding the same field rules. The mismatches column is the
+parity check: every backend has to find the fields corpus.json expects.
+Backends that aren't installed are skipped. Renaming runs the full
+rename_pdfs pipeline into a temporary folder at each worker count, and
+once more with --output-strategy move on a copy of the corpus plus a
+byte-identical copy of its first invoice, which has to come out as a
+duplicate rather than be renamed a second time.
+Every measurement runs in a fresh interpreter so peak RSS is its own.
+
+Run from the DobY folder:
+    python benchmarks/bench_throughput.py bench_corpus --generate 500
+    python benchmarks/bench_throughput.py bench_corpus --backends pdfium --workers 1,8
+"""
+import argparse
+import json
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+def extract_with(backend, text_mode):
+    def extract(pdf_path):
+        from doby_core import process_pdf
+        return process_pdf(pdf_path, text_mode=text_mode, backend=backend)["invoice_data"]
+    return extract
+
+
+def extract_like_v1(pdf_path):
+    import pdfplumber
+    from doby_core import extract_invoice_data_for_rename
+    with pdfplumber.open(pdf_path) as pdf:
+        text_list = [page.extract_text() or "" for page in pdf.pages]
+    # dobyv1.0.2 joins the page texts with spaces before matching
+    return extract_invoice_data_for_rename(" ".join(text_list), os.path.basename(pdf_path), lambda message: None)
+
+
+EXTRACT_BACKENDS = {}
+for backend in ("pdfium", "pymupdf", "pdfplumber"):
+    EXTRACT_BACKENDS[backend] = extract_with(backend, "full")
+    EXTRACT_BACKENDS[f"{backend}-header"] = extract_with(backend, "header")
+EXTRACT_BACKENDS["pdfplumber-v1"] = extract_like_v1
+
+
+def peak_rss_mb(include_children=False):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def load_corpus(corpus_dir):
+    with open(os.path.join(corpus_dir, "corpus.json")) as f:
+        return json.load(f)
+
+
+def measure_extract(corpus_dir, backend):
+    corpus = load_corpus(corpus_dir)
+    extract = EXTRACT_BACKENDS[backend]
+    latencies = []
+    mismatches = 0
+    started = time.perf_counter()
+    for filename, info in corpus.items():
+        file_started = time.perf_counter()
+        invoice_data = extract(os.path.join(corpus_dir, filename))
+        latencies.append(time.perf_counter() - file_started)
+        if invoice_data != info["expected"]:
+            mismatches += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "mismatches": mismatches,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def measure_rename(corpus_dir, workers, output_strategy="copy"):
+    from doby_core import RenameOptions, read_journal, rename_pdfs
+    corpus = load_corpus(corpus_dir)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if output_strategy == "move":
+            # Moving empties the input folder, so move a copy, with the first invoice in it twice
+            input_dir = os.path.join(work_dir, "in")
+            os.makedirs(input_dir)
+            for filename in corpus:
+                shutil.copy(os.path.join(corpus_dir, filename), input_dir)
+            pdf_paths = [os.path.join(input_dir, filename) for filename in corpus]
+            duplicate_path = os.path.join(input_dir, "duplicate.pdf")
+            shutil.copy(pdf_paths[0], duplicate_path)
+            pdf_paths.append(duplicate_path)
+            expected_duplicates = 1
+        else:
+            pdf_paths = [os.path.join(corpus_dir, filename) for filename in corpus]
+            expected_duplicates = 0
+        options = RenameOptions(os.path.join(work_dir, "out"), max_workers=workers, use_cache=False,
+                                output_strategy=output_strategy)
+        started = time.perf_counter()
+        run = rename_pdfs(pdf_paths, options, lambda message: None)
+        elapsed = time.perf_counter() - started
+        latencies = [
+            record["read_seconds"] + record["write_seconds"]
+            for record in read_journal(run.journal.path, ("renamed", "skipped"))
+        ]
+    expected_renamed = sum(1 for info in corpus.values() if info["expected"])
+    return {
+        "elapsed": elapsed,
+        "latencies": latencies,
+        "mismatches": abs(run.renamed_count - expected_renamed) + abs(run.duplicate_count - expected_duplicates),
+        "peak_rss_mb": peak_rss_mb(include_children=True),
+    }
+
+
+def run_child(args):
+    if args[0] == "extract":
+        result = measure_extract(args[1], args[2])
+    else:
+        result = measure_rename(args[1], int(args[2]), *args[3:])
+    print(json.dumps(result))
+
+
+def run_in_fresh_process(*args):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", *args],
+        capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        return None, completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed"
+    return json.loads(completed.stdout.strip().splitlines()[-1]), None
+
+
+def report_row(label, result, files, pages):
+    latencies = sorted(result["latencies"])
+    rss = result["peak_rss_mb"]
+    print(
+        f"{label:<24}{files / result['elapsed']:>10.1f}{pages / result['elapsed']:>11.1f}"
+        f"{percentile(latencies, 50) * 1000:>10.2f}{percentile(latencies, 99) * 1000:>10.2f}"
+        f"{(f'{rss:.0f}' if rss is not None else 'n/a'):>10}{result['mismatches']:>12}"
+    )
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        run_child(sys.argv[2:])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark DobY extraction and renaming throughput.")
+    parser.add_argument("corpus_dir", help="folder made by synthetic_invoices.py")
+    parser.add_argument("--generate", type=int, metavar="N", help="(re)generate the corpus with N invoices first")
+    parser.add_argument("--pages", default="1,2,5,20", help="page counts for --generate")
+    parser.add_argument("--backends", default=",".join(EXTRACT_BACKENDS), help="extraction backends to compare")
+    parser.add_argument("--workers", default=f"1,{os.cpu_count() or 1}", help="worker counts for the rename runs")
+    args = parser.parse_args()
+
+    if args.generate:
+        from synthetic_invoices import generate_corpus
+        generate_corpus(args.corpus_dir, args.generate, [int(pages) for pages in args.pages.split(",")])
+    corpus = load_corpus(args.corpus_dir)
+    files = len(corpus)
+    pages = sum(info["pages"] for info in corpus.values())
+    print(f"Corpus: {files} invoices, {pages} pages\n")
+    print(f"{'run':<24}{'files/s':>10}{'pages/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>10}{'mismatches':>12}")
+
+    from doby_core import TEXT_BACKENDS
+    for backend in args.backends.split(","):
+        library = TEXT_BACKENDS.get(backend.split("-")[0]) # e.g. "pdfplumber" for "pdfplumber-v1"
+        if library is not None and not library.available():
+            print(f"{'extract ' + backend:<24}  skipped: {library.module_names[0]} isn't installed")
+            continue
+        result, error = run_in_fresh_process("extract", args.corpus_dir, backend)
+        if result is None:
+            print(f"{'extract ' + backend:<24}  skipped: {error}")
+        else:
+            report_row(f"extract {backend}", result, files, pages)
+    for workers in dict.fromkeys(args.workers.split(",")):
+        result, error = run_in_fresh_process("rename", args.corpus_dir, workers)
+        if result is None:
+            print(f"{'rename x' + workers:<24}  skipped: {error}")
+        else:
+            report_row(f"rename, {workers} worker(s)", result, files, pages)
+    workers = args.workers.split(",")[-1]
+    result, error = run_in_fresh_process("rename", args.corpus_dir, workers, "move")
+    if result is None:
+        print(f"{'rename move x' + workers:<24}  skipped: {error}")
+    else:
+        report_row(f"rename move, {workers} w", result, files, pages)
+    print("\nPages/s counts every page in the corpus, including pages the early exit never opens.")
+
+
+if __name__ == "__main__":
+    main()
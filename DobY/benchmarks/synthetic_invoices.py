@@ -0,0 +1,156 @@
+"""Generate a corpus of synthetic invoice PDFs for benchmarking DobY.
+
+Every sender in the rules file is combined with every client in it, and
+page counts cycle through --pages. Each client's manifest line is the
+first of MANIFEST_LINE_FORMATS its pattern in the rules file reads back,
+so clients added to the rules file need no changes here. The PDFs
+are written by hand with the standard Helvetica font so nothing beyond the
+standard library is needed. corpus.json next to them lists the fields each
+invoice should produce, or null for the ones meant to be skipped.
+
+Run from the DobY folder:
+    python benchmarks/synthetic_invoices.py bench_corpus -n 500 --pages 1,5,20
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from doby_core import RULES
+
+# Ways a client's manifest line can be written, tried in order against its pattern
+MANIFEST_LINE_FORMATS = (
+    "{client} - MANIFEST {manifest}",
+    "{client} {manifest}",
+    "{client} MANIFEST {manifest}",
+    "{client} MANIFEST NO. {manifest}",
+)
+LINES_PER_PAGE = 55
+
+
+@functools.lru_cache(maxsize=None)
+def manifest_line_format(client):
+    """The first of MANIFEST_LINE_FORMATS that the rules read back as client, or the first one if none is."""
+    for line_format in MANIFEST_LINE_FORMATS:
+        fields = RULES.match(line_format.format(client=client, manifest="123456") + "\n")
+        if fields.get("client_for_naming") == client and fields.get("manifest_num") == "123456":
+            return line_format
+    return MANIFEST_LINE_FORMATS[0]
+
+
+def pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path, pages):
+    """Write pages, each a list of text lines, as a plain PDF 1.4 file."""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None, # Page tree, filled in once the page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_refs = []
+    for lines in pages:
+        content = ["BT", "/F1 9 Tf", "11 TL", "50 760 Td"]
+        content.extend(f"({pdf_escape(line)}) '" for line in lines)
+        content.append("ET")
+        stream = "\n".join(content).encode("cp1252", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects))
+        )
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>".encode("ascii")
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def invoice_pages(sender, client, manifest, our_ref_num, page_count, rng):
+    header = [
+        sender,
+        "Plot 4412, Freedom Way, Kitwe, Zambia",
+        "TPIN: 1001%06d" % rng.randrange(10 ** 6),
+        "",
+        "TAX INVOICE",
+        f"Our Ref Num: {our_ref_num}" if our_ref_num else "Reference: to follow",
+        f"Invoice Date: 2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        manifest_line_format(client).format(client=client, manifest=manifest),
+        "",
+        "Item  Description                              Qty   Rate USD     Amount USD",
+    ]
+    pages = []
+    item = 1
+    for page_number in range(page_count):
+        lines = list(header) if page_number == 0 else [f"{sender} - continued, page {page_number + 1}"]
+        while len(lines) < LINES_PER_PAGE:
+            qty = rng.randint(1, 40)
+            rate = rng.randint(150, 4800)
+            lines.append(f"{item:>4}  Haulage Kolwezi - Dar es Salaam, truck {rng.randint(100, 999)}  {qty:>5} {rate:>10,.2f} {qty * rate:>14,.2f}")
+            item += 1
+        pages.append(lines)
+    return pages
+
+
+def generate_corpus(out_dir, count, page_counts, unmatched_ratio=0.05, seed=1):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    combinations = itertools.cycle(
+        itertools.product(RULES.company_abbreviations.items(), RULES.client_manifest_patterns.keys())
+    )
+    page_cycle = itertools.cycle(page_counts)
+    manifest = {}
+    for i in range(count):
+        (sender, company_code), client = next(combinations)
+        pages = next(page_cycle)
+        manifest_num = str(rng.randint(10000, 999999))
+        unmatched = rng.random() < unmatched_ratio
+        our_ref_num = None if unmatched else f"{company_code}{rng.randint(100000, 999999)}"
+        filename = f"invoice_{i:06d}.pdf"
+        write_pdf(os.path.join(out_dir, filename), invoice_pages(sender, client, manifest_num, our_ref_num, pages, rng))
+        manifest[filename] = {
+            "pages": pages,
+            "expected": None if unmatched else {
+                "company_code": company_code,
+                "client_for_naming": client,
+                "manifest_num": manifest_num,
+                "our_ref_num": our_ref_num,
+            },
+        }
+    with open(os.path.join(out_dir, "corpus.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic invoice PDFs for DobY benchmarks.")
+    parser.add_argument("out_dir")
+    parser.add_argument("-n", "--count", type=int, default=200, help="number of invoices (default: 200)")
+    parser.add_argument("--pages", default="1,2,5,20", help="comma separated page counts to cycle through")
+    parser.add_argument("--unmatched-ratio", type=float, default=0.05, help="share of invoices without a ref num")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    page_counts = [int(pages) for pages in args.pages.split(",")]
+    generate_corpus(args.out_dir, args.count, page_counts, args.unmatched_ratio, args.seed)
+    print(f"Wrote {args.count} invoices to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
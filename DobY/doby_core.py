@@ -0,0 +1,2937 @@
+"""Invoice extraction and renaming for DobY.
+
+Nothing in here imports tkinter or customtkinter, so these functions can be
+handed to worker processes without every worker loading the GUI stack, and
+the same renaming runs headless from the command line:
+
+    python -m doby_core "C:\\Invoices\\May" --output "D:\\Renamed Invoices" --workers 8
+"""
+import argparse
+import errno
+import filecmp
+import hashlib
+import heapq
+import importlib
+import importlib.util
+import io
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import pathlib
+import re
+import shutil
+import signal
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing.connection import wait as wait_for_connections
+
+import pypdfium2 as pdfium
+
+try:
+    import fcntl # Only needed for reflinks, which are Linux only
+except ImportError:
+    fcntl = None
+
+try:
+    import ahocorasick # Optional C automaton for sender names, pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import psutil # Optional, lets the memory ceiling work where there is no /proc
+except ImportError:
+    psutil = None
+
+try:
+    import resource # CPU and memory limits for the PDF reading workers, not on Windows
+except ImportError:
+    resource = None
+
+# Used when a rules file has no "our_ref_num_pattern"
+OUR_REF_NUM_PATTERN = r"Our Ref Num:\s*([A-Z0-9]+)"
+
+# Page regions that "header" text mode reads on the first page before falling
+# back to whole pages, used when a rules file has no "text_regions". Each region
+# is (left, top, right, bottom) as fractions of the page, measured from its top
+# left corner.
+DEFAULT_TEXT_REGIONS = (
+    (0.0, 0.0, 1.0, 0.35), # Letterhead, ref num and manifest block
+)
+
+RULES_PATH_ENV = "DOBY_RULES"
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "doby_rules.json")
+
+
+class SenderMatcher:
+    """Finds the first known sender name in lowercased text, however many names there are.
+
+    The names are compiled into an Aho-Corasick automaton, so one pass over
+    the text costs about the same for ten senders or ten thousand, where a
+    regex alternation slows down with every name added. The C automaton from
+    pyahocorasick is used when it is installed. Without it, lists of up to
+    REGEX_MAX_SENDERS names still use a regex, which is quicker than the pure
+    Python automaton until the list gets that long.
+    """
+
+    REGEX_MAX_SENDERS = 64
+    IMPLEMENTATIONS = ("pyahocorasick", "automaton", "regex")
+
+    def __init__(self, names, implementation=None):
+        names = sorted({name.lower() for name in names if name}, key=len, reverse=True)
+        if implementation is None:
+            if ahocorasick is not None:
+                implementation = "pyahocorasick"
+            else:
+                implementation = "regex" if len(names) <= self.REGEX_MAX_SENDERS else "automaton"
+        self.implementation = implementation
+        self.max_length = len(names[0]) if names else 0
+
+        if implementation == "regex":
+            # Longest first so a name that is a prefix of another cannot shadow it
+            self.pattern = re.compile("|".join(re.escape(name) for name in names)) if names else None
+        elif implementation == "pyahocorasick":
+            self.automaton = ahocorasick.Automaton()
+            for name in names:
+                self.automaton.add_word(name, len(name))
+            if names:
+                self.automaton.make_automaton()
+        elif implementation == "automaton":
+            self._build_automaton(names)
+        else:
+            raise ValueError(f"Unknown sender matcher {implementation!r}, expected one of {self.IMPLEMENTATIONS}")
+
+    def _build_automaton(self, names):
+        # State 0 is the root. longest[state] is the length of the longest name
+        # ending at that state, including names reached through failure links.
+        goto = [{}]
+        longest = [0]
+        for name in names:
+            state = 0
+            for char in name:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    goto.append({})
+                    longest.append(0)
+                    next_state = goto[state][char] = len(goto) - 1
+                state = next_state
+            longest[state] = len(name)
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for state in queue: # Breadth first, queue grows as we go
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(char, 0) if state else 0
+                longest[next_state] = max(longest[next_state], longest[fail[next_state]])
+        self.goto, self.fail, self.longest = goto, fail, longest
+
+    def find(self, lowered_text):
+        """Return (start, end) of the leftmost name in lowered_text, the longest if several start there, or None."""
+        if self.implementation == "regex":
+            match = self.pattern.search(lowered_text) if self.pattern else None
+            return match.span() if match else None
+        if not self.max_length:
+            return None
+        if self.implementation == "pyahocorasick":
+            matches = self.automaton.iter(lowered_text)
+        else:
+            matches = self._iter_automaton(lowered_text)
+        best = None
+        for end, length in matches:
+            if best is not None and end - self.max_length >= best[0]:
+                break # Nothing ending here or later can start earlier
+            start = end - length + 1
+            if best is None or start <= best[0]:
+                best = (start, end + 1)
+        return best
+
+    def _iter_automaton(self, text):
+        """Yield (end index, longest length) for each position where a name ends."""
+        goto, fail, longest = self.goto, self.fail, self.longest
+        state = 0
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if longest[state]:
+                yield end, longest[state]
+
+
+class InvoiceRuleEngine:
+    """Every invoice field pattern compiled once, built from a rules file at startup.
+
+    Sender names go into a SenderMatcher. Each client manifest pattern, in
+    table order, and the Our Ref Num pattern are searched on their own, so
+    a pattern can use any re syntax and no field's match can hide another's.
+    The text is lowercased once and searched with lowercased patterns rather
+    than with re.IGNORECASE, because re can then skip ahead to each place a
+    pattern's leading literal appears instead of case-folding every
+    character. A pattern that can't be lowercased safely is searched with
+    re.IGNORECASE instead. The matched sender maps back to its abbreviation
+    with a case-folded dict lookup.
+    """
+
+    def __init__(self, company_abbreviations, client_manifest_patterns, our_ref_num_pattern=OUR_REF_NUM_PATTERN,
+                 sender_matcher=None, text_regions=DEFAULT_TEXT_REGIONS, sender_text_regions=None):
+        self.company_abbreviations = dict(company_abbreviations)
+        self.client_manifest_patterns = dict(client_manifest_patterns)
+        self.our_ref_num_pattern = our_ref_num_pattern
+        self.text_regions = parse_text_regions(text_regions) # What "header" text mode reads first
+        # Extra regions by company code, read once the sender is known and a field is still missing
+        self.sender_text_regions = {}
+        for company_code, regions in (sender_text_regions or {}).items():
+            if company_code not in self.company_abbreviations.values():
+                raise ValueError(f"Text regions for {company_code!r}, which is not the code of any sender")
+            self.sender_text_regions[company_code] = parse_text_regions(regions)
+        self.company_codes = {name.casefold(): code for name, code in company_abbreviations.items()}
+        # Changes whenever the rules do, so cached results from older rules are not reused
+        self.version = hashlib.sha256(
+            json.dumps([company_abbreviations, client_manifest_patterns, our_ref_num_pattern]).encode("utf-8")
+        ).hexdigest()
+        self.client_names = list(client_manifest_patterns.keys())
+
+        self.sender_matcher = SenderMatcher(company_abbreviations.keys(), sender_matcher)
+
+        # (lowered, ignorecase) compiled forms of each pattern, clients in table order
+        self.client_patterns = [self._compile_value_pattern(pattern) for pattern in client_manifest_patterns.values()]
+        self.our_ref_num_patterns = self._compile_value_pattern(our_ref_num_pattern)
+
+    # Pattern syntax copied as it is: group names and references, comments,
+    # conditionals, and the headers of lookarounds, atomic groups and flag groups
+    _GROUP_SYNTAX = re.compile(r"\(\?P<[^>]*>|\(\?P=[^)]*\)|\(\?#[^)]*\)|\(\?\([^)]*\)|\(\?(?:<?[=!]|>|[aiLmsux-]*[:)])")
+
+    @classmethod
+    def _lower_pattern(cls, pattern):
+        """Lowercase the literal text in pattern, or return None where that would change what it matches.
+
+        Escapes such as \\S or \\D and group syntax such as (?P<num>...) are
+        copied as they are. In a character class, a range is lowercased when
+        it lies within A-Z and kept when it holds no cased characters. Other
+        ranges, escapes that give a character by its code or name, and
+        characters whose lowercase is longer than they are give None.
+        """
+        lowered = []
+        i = 0
+        in_class = False
+        while i < len(pattern):
+            char = pattern[i]
+            if char == "\\":
+                escape = pattern[i + 1:i + 2]
+                if (not escape or escape in "xuUN0" or (in_class and escape.isdigit())
+                        or re.match(r"[0-7]{3}", pattern[i + 1:i + 4])):
+                    return None
+                lowered.append(pattern[i:i + 2])
+                i += 2
+            elif in_class:
+                if char == "]":
+                    in_class = False
+                    lowered.append(char)
+                    i += 1
+                elif pattern[i + 1:i + 2] == "-" and pattern[i + 2:i + 3] not in ("", "]", "\\"):
+                    low, high = char, pattern[i + 2]
+                    if "A" <= low <= high <= "Z":
+                        lowered.append(f"{low.lower()}-{high.lower()}")
+                    elif any(chr(code).lower() != chr(code) for code in range(ord(low), ord(high) + 1)):
+                        return None
+                    else:
+                        lowered.append(pattern[i:i + 3])
+                    i += 3
+                elif len(char.lower()) != 1:
+                    return None
+                else:
+                    lowered.append(char.lower())
+                    i += 1
+            elif char == "[":
+                # A ] straight after the [ or [^ is a literal, not the end of the class
+                opening = re.match(r"\[\^?\]?", pattern[i:]).group()
+                lowered.append(opening)
+                in_class = True
+                i += len(opening)
+            elif pattern.startswith("(?", i):
+                syntax = cls._GROUP_SYNTAX.match(pattern, i)
+                if syntax is None:
+                    return None
+                lowered.append(syntax.group())
+                i = syntax.end()
+            elif len(char.lower()) != 1:
+                return None
+            else:
+                lowered.append(char.lower())
+                i += 1
+        lowered = "".join(lowered)
+        try:
+            if re.compile(lowered).groups != re.compile(pattern).groups:
+                return None
+        except re.error:
+            return None
+        return lowered
+
+    @classmethod
+    def _compile_value_pattern(cls, pattern):
+        """pattern compiled for lowercased text, or None if it can't be lowercased, and with re.IGNORECASE."""
+        ignorecase = re.compile(pattern, re.IGNORECASE)
+        if ignorecase.groups != 1:
+            raise ValueError(f"Pattern {pattern!r} needs exactly one capture group for the value")
+        lowered = cls._lower_pattern(pattern)
+        return (re.compile(lowered) if lowered is not None else None), ignorecase
+
+    @staticmethod
+    def _search(patterns, pdf_text, lowered_text):
+        lowered, ignorecase = patterns
+        if lowered is not None and lowered_text is not None:
+            return lowered.search(lowered_text)
+        return ignorecase.search(pdf_text)
+
+    @property
+    def has_senders(self):
+        return bool(self.company_codes)
+
+    def company_code(self, found_name_in_pdf):
+        return self.company_codes.get(found_name_in_pdf.casefold())
+
+    def match(self, pdf_text, fields=None):
+        """Fill in whichever of fields is still missing from pdf_text.
+
+        The sender and ref num come from their first occurrence, and the
+        longest sender name wins when several start at the same place. For the
+        client, the earliest entry in the pattern table that appears anywhere
+        in pdf_text wins, the same as checking the patterns one by one.
+        Values are sliced from pdf_text so they keep their original case.
+        """
+        if fields is None:
+            fields = {}
+        need_sender = "sender" not in fields and self.has_senders
+        need_client = "client_for_naming" not in fields
+        need_ref = "our_ref_num" not in fields
+        if not (need_sender or need_client or need_ref):
+            return fields
+
+        lowered_text = pdf_text.lower()
+        if len(lowered_text) != len(pdf_text):
+            lowered_text = None # Its offsets no longer line up with pdf_text
+        if need_sender:
+            # A dotted capital I is the only character whose lowercase is longer
+            span = self.sender_matcher.find(
+                lowered_text if lowered_text is not None else pdf_text.replace("\u0130", "I").lower()
+            )
+            if span is not None:
+                fields["sender"] = pdf_text[span[0]:span[1]]
+        if need_ref:
+            match = self._search(self.our_ref_num_patterns, pdf_text, lowered_text)
+            if match:
+                fields["our_ref_num"] = pdf_text[match.start(1):match.end(1)]
+        if need_client:
+            for client_name, patterns in zip(self.client_names, self.client_patterns):
+                match = self._search(patterns, pdf_text, lowered_text)
+                if match:
+                    fields["client_for_naming"] = client_name
+                    fields["manifest_num"] = pdf_text[match.start(1):match.end(1)]
+                    break
+        return fields
+
+
+def parse_text_regions(regions):
+    """Check a list of (left, top, right, bottom) page fractions and return it as a tuple of tuples."""
+    parsed = []
+    for region in regions:
+        if (not isinstance(region, (list, tuple)) or len(region) != 4
+                or not all(isinstance(edge, (int, float)) and not isinstance(edge, bool) for edge in region)):
+            raise ValueError(f"Text region {region!r} should be [left, top, right, bottom]")
+        left, top, right, bottom = region
+        if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+            raise ValueError(f"Text region {region!r} should be fractions of the page with left < right and top < bottom")
+        parsed.append((float(left), float(top), float(right), float(bottom)))
+    if not parsed:
+        raise ValueError("A list of text regions needs at least one region")
+    return tuple(parsed)
+
+
+def load_rules(path=None):
+    """Compile the rules file at path, by default $DOBY_RULES or doby_rules.json next to this module.
+
+    The file is JSON with "company_abbreviations" (sender name to code),
+    "client_manifest_patterns" (client name to a pattern with one capture
+    group for the manifest number, checked in file order so the first
+    client that matches wins) and optionally "our_ref_num_pattern" and
+    "text_regions". text_regions has the "default" regions "header" text
+    mode reads and, under "senders", extra regions by company code, each
+    region [left, top, right, bottom] as fractions of the page.
+    """
+    path = path or os.environ.get(RULES_PATH_ENV) or DEFAULT_RULES_PATH
+    with open(path, encoding="utf-8") as f:
+        rules = json.load(f)
+    text_regions = rules.get("text_regions", {})
+    if not isinstance(text_regions, dict) or not isinstance(text_regions.get("senders", {}), dict):
+        raise ValueError(f'Rules file {path} should list its "text_regions" as "default" and, by company code, "senders"')
+    try:
+        return InvoiceRuleEngine(
+            rules["company_abbreviations"],
+            rules["client_manifest_patterns"],
+            rules.get("our_ref_num_pattern", OUR_REF_NUM_PATTERN),
+            text_regions=text_regions.get("default", DEFAULT_TEXT_REGIONS),
+            sender_text_regions=text_regions.get("senders")
+        )
+    except KeyError as e:
+        raise ValueError(f"Rules file {path} has no {e} section") from None
+    except (ValueError, re.error) as e:
+        raise ValueError(f"Rules file {path}: {e}") from None
+
+
+def use_rules(path):
+    """Switch RULES to the rules file at path, here and in worker processes started after this."""
+    global RULES
+    RULES = load_rules(path)
+    os.environ[RULES_PATH_ENV] = os.path.abspath(path) # Spawned workers load their rules from here
+    return RULES
+
+
+RULES = load_rules()
+
+# Everything extract_invoice_data_for_rename needs before a PDF can be renamed
+REQUIRED_FIELDS = ("sender", "client_for_naming", "our_ref_num")
+
+TEXT_MODES = ("full", "header")
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.expanduser("~"), "Desktop", "Renamed Invoices")
+CACHE_FILENAME = "_DobY_Extraction_Cache.sqlite3"
+JOURNAL_PREFIX = "_Renaming_Journal_"
+PARTIAL_SUFFIX = ".doby-partial" # Output files still being written
+DEFAULT_CACHE_MAX_ENTRIES = 200000
+MMAP_THRESHOLD = 16 * 1024 * 1024 # With single_read, inputs this big are mapped instead of read into memory
+
+# How each output strategy falls back when the filesystem cannot do it
+OUTPUT_STRATEGY_FALLBACKS = {
+    "copy": ("copy",),
+    "hardlink": ("hardlink", "reflink", "copy"),
+    "reflink": ("reflink", "copy"),
+    "move": ("move", "copy and delete"),
+}
+OUTPUT_STRATEGIES = tuple(OUTPUT_STRATEGY_FALLBACKS.keys())
+# Subfolders renamed files can be sorted into, outermost first in the order
+# chosen: the client, the sender's company code, and the year and month the
+# PDF was last modified, e.g. "CMOC/NE/2025-03"
+SHARD_LEVELS = ("client", "company", "month")
+FICLONE = 0x40049409 # From linux/fs.h
+# PDFs handed to the workers ahead of the one being stored. Enough that one
+# slow PDF doesn't leave workers idle, small enough that memory stays flat.
+READ_AHEAD_PER_WORKER = 8
+# Limits on reading one PDF in a worker process, so a malformed file that
+# spins or balloons only costs itself; None or 0 turns a limit off
+DEFAULT_READ_TIMEOUT = 120     # Wall-clock seconds before the worker is killed
+DEFAULT_READ_CPU_SECONDS = 60  # CPU seconds, where RLIMIT_CPU exists
+DEFAULT_RECYCLE_AFTER = 200    # PDFs a worker reads before a fresh one replaces it
+# Files being written to the output folders at once, and queued per writer
+# ahead of the one waiting to be journaled
+DEFAULT_WRITE_WORKERS = 4
+WRITE_AHEAD_PER_WRITER = 4
+
+
+def default_worker_count():
+    return os.cpu_count() or 1
+
+
+def current_rss():
+    """Resident memory of this process in bytes, or None where it can't be read."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+@contextmanager
+def timed_stage(timings, stage):
+    """Add the time spent in the with block to timings[stage], if timings is a dict."""
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+class MappedReader(io.RawIOBase):
+    """A file object over an mmap, for libraries that want one; an mmap has no readinto."""
+
+    def __init__(self, mapped):
+        self.mapped = mapped
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.mapped.seek(offset, whence)
+        return self.mapped.tell()
+
+    def tell(self):
+        return self.mapped.tell()
+
+    def readinto(self, buffer):
+        data = self.mapped.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class PdfBuffer:
+    """One input PDF, read once, for hashing it, reading its text and writing its copy.
+
+    Files under MMAP_THRESHOLD are read into bytes. Bigger ones are mapped,
+    so they never sit in a worker's heap, and each block still only comes
+    over the network once. The text backends open a PdfBuffer like a path.
+    """
+
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.views = [] # memoryviews handed out, released on close
+        with open(pdf_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = f.read()
+
+    @property
+    def mapped(self):
+        return isinstance(self.data, mmap.mmap)
+
+    def view(self):
+        view = memoryview(self.data)
+        self.views.append(view)
+        return view
+
+    def reader(self):
+        """A file object over the data; BytesIO shares the bytes instead of copying them."""
+        if self.mapped:
+            self.data.seek(0)
+            return MappedReader(self.data)
+        return io.BytesIO(self.data)
+
+    def digest(self):
+        return hashlib.sha256(self.data).hexdigest()
+
+    def write_copy(self, directory):
+        """Write the PDF, with its times and permissions, to a new partial file in directory and return its path."""
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=PARTIAL_SUFFIX, dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+            shutil.copystat(self.pdf_path, temp_path)
+        except BaseException:
+            remove_file(temp_path)
+            raise
+        return temp_path
+
+    def close(self):
+        if not self.mapped:
+            return
+        try:
+            for view in self.views:
+                view.release()
+            self.data.close()
+        except BufferError:
+            pass # A library still holds on to it; the mapping goes once that is collected
+
+
+class TextBackend:
+    """Gets the text out of PDFs with one PDF library.
+
+    Documents and pages are whatever the library uses for them. Regions
+    are (left, top, right, bottom) fractions of the page measured from its
+    top left corner, as in the rules file's text_regions. The library is imported
+    the first time the backend is used, so ones that are never picked
+    don't slow down starting DobY or its worker processes. open takes a
+    path or a PdfBuffer.
+    """
+
+    name = None
+    module_names = () # What the library can be imported as, preferred name first
+
+    def __init__(self):
+        self._module = None
+
+    def installed_module_name(self):
+        return next((name for name in self.module_names if importlib.util.find_spec(name) is not None), None)
+
+    def available(self):
+        return self.installed_module_name() is not None
+
+    @property
+    def module(self):
+        if self._module is None:
+            module_name = self.installed_module_name()
+            if module_name is None:
+                raise ImportError(f"{self.name} needs {self.module_names[0]}, which isn't installed")
+            self._module = importlib.import_module(module_name)
+        return self._module
+
+    def open(self, pdf_path):
+        raise NotImplementedError
+
+    def close(self, pdf_doc):
+        pdf_doc.close()
+
+    def page_count(self, pdf_doc):
+        raise NotImplementedError
+
+    def open_page(self, pdf_doc, index):
+        raise NotImplementedError
+
+    def close_page(self, page):
+        pass
+
+    def page_text(self, page):
+        raise NotImplementedError
+
+    def region_text(self, page, regions):
+        raise NotImplementedError
+
+
+class PdfiumTextBackend(TextBackend):
+    """pypdfium2, what DobY v2 has always used. Always installed."""
+
+    name = "pdfium"
+    module_names = ("pypdfium2",)
+
+    def open(self, pdf_path):
+        if isinstance(pdf_path, PdfBuffer):
+            # Bytes are handed to pdfium as they are, a mapped file is read block by block
+            return pdfium.PdfDocument(pdf_path.reader() if pdf_path.mapped else pdf_path.data)
+        return pdfium.PdfDocument(pdf_path)
+
+    def page_count(self, pdf_doc):
+        return len(pdf_doc)
+
+    def open_page(self, pdf_doc, index):
+        page = pdf_doc.get_page(index)
+        try:
+            return page, page.get_textpage()
+        except Exception:
+            page.close()
+            raise
+
+    def close_page(self, page):
+        page, textpage = page
+        try:
+            textpage.close()
+        finally:
+            page.close()
+
+    def page_text(self, page):
+        return page[1].get_text_range()
+
+    def region_text(self, page, regions):
+        # pdfium builds the whole page's text either way, so this is no cheaper than page_text
+        page, textpage = page
+        width, height = page.get_size()
+        return "\n".join(
+            textpage.get_text_bounded(
+                left=left * width, bottom=height * (1 - bottom), right=right * width, top=height * (1 - top)
+            )
+            for left, top, right, bottom in regions
+        )
+
+
+class PyMuPDFTextBackend(TextBackend):
+    """PyMuPDF, which the QR Inserter reads invoices with. pip install pymupdf"""
+
+    name = "pymupdf"
+    module_names = ("pymupdf", "fitz") # fitz before PyMuPDF 1.24
+
+    def open(self, pdf_path):
+        if isinstance(pdf_path, PdfBuffer):
+            return self.module.open(stream=pdf_path.view(), filetype="pdf")
+        return self.module.open(pdf_path)
+
+    def page_count(self, pdf_doc):
+        return pdf_doc.page_count
+
+    def open_page(self, pdf_doc, index):
+        return pdf_doc.load_page(index)
+
+    def page_text(self, page):
+        return page.get_text()
+
+    def region_text(self, page, regions):
+        width, height = page.rect.width, page.rect.height
+        return "\n".join(
+            page.get_text(clip=self.module.Rect(left * width, top * height, right * width, bottom * height))
+            for left, top, right, bottom in regions
+        )
+
+
+class PdfplumberTextBackend(TextBackend):
+    """pdfplumber, which DobY v1 used. Much slower, kept for PDFs the others read badly. pip install pdfplumber"""
+
+    name = "pdfplumber"
+    module_names = ("pdfplumber",)
+
+    def open(self, pdf_path):
+        if isinstance(pdf_path, PdfBuffer):
+            return self.module.open(pdf_path.reader())
+        return self.module.open(pdf_path)
+
+    def page_count(self, pdf_doc):
+        return len(pdf_doc.pages)
+
+    def open_page(self, pdf_doc, index):
+        return pdf_doc.pages[index]
+
+    def close_page(self, page):
+        page.close()
+
+    def page_text(self, page):
+        return page.extract_text() or ""
+
+    def region_text(self, page, regions):
+        width, height = page.width, page.height
+        return "\n".join(
+            page.crop((left * width, top * height, right * width, bottom * height)).extract_text() or ""
+            for left, top, right, bottom in regions
+        )
+
+
+TEXT_BACKENDS = {backend.name: backend for backend in (PdfiumTextBackend(), PyMuPDFTextBackend(), PdfplumberTextBackend())}
+DEFAULT_TEXT_BACKEND = "pdfium" # The reference the others have to agree with
+TEXT_BACKEND_CHOICES = ("auto",) + tuple(TEXT_BACKENDS)
+
+
+def installed_text_backends():
+    return [name for name, backend in TEXT_BACKENDS.items() if backend.available()]
+
+
+def iter_page_texts(pdf_path, timings=None, backend=DEFAULT_TEXT_BACKEND):
+    """Yield the text of each page of pdf_path, one page at a time, read with the named backend.
+
+    Pages are only opened when the next one is asked for, and closing the
+    generator early closes the document without touching the rest. With a
+    timings dict, opening and closing the document count as "open" and
+    getting each page's text as "text".
+    """
+    text_backend = TEXT_BACKENDS[backend]
+    with timed_stage(timings, "open"):
+        pdf_doc = text_backend.open(pdf_path)
+    try:
+        yield from iter_document_page_texts(pdf_doc, timings, backend)
+    finally:
+        with timed_stage(timings, "open"):
+            text_backend.close(pdf_doc)
+
+
+def iter_document_page_texts(pdf_doc, timings=None, backend=DEFAULT_TEXT_BACKEND, start=0):
+    text_backend = TEXT_BACKENDS[backend]
+    for i in range(start, text_backend.page_count(pdf_doc)):
+        with timed_stage(timings, "text"):
+            page = text_backend.open_page(pdf_doc, i)
+            try:
+                page_text = text_backend.page_text(page)
+            finally:
+                text_backend.close_page(page)
+        yield page_text + "\n"
+
+
+def read_header_fields(pdf_doc, timings=None, backend=DEFAULT_TEXT_BACKEND):
+    """Match the header regions of pdf_doc's first page, then the sender's own regions if it has any.
+
+    Returns (fields, first_page_text). first_page_text is the whole first
+    page's text when a required field is still missing, taken from the
+    page while it is open so it isn't parsed a second time, or else None.
+    """
+    text_backend = TEXT_BACKENDS[backend]
+    with timed_stage(timings, "text"):
+        page = text_backend.open_page(pdf_doc, 0)
+    try:
+        def match_regions(regions, fields):
+            with timed_stage(timings, "text"):
+                region_text = text_backend.region_text(page, regions)
+            with timed_stage(timings, "match"):
+                match_invoice_fields(region_text + "\n", fields)
+
+        fields = {}
+        match_regions(RULES.text_regions, fields)
+        company_code = RULES.company_code(fields["sender"]) if "sender" in fields else None
+        if company_code in RULES.sender_text_regions and not all(field in fields for field in REQUIRED_FIELDS):
+            match_regions(RULES.sender_text_regions[company_code], fields)
+        if all(field in fields for field in REQUIRED_FIELDS):
+            return fields, None
+        with timed_stage(timings, "text"):
+            return fields, text_backend.page_text(page) + "\n"
+    finally:
+        text_backend.close_page(page)
+
+
+def extract_text_from_pdf(pdf_path, log, backend=DEFAULT_TEXT_BACKEND):
+    try:
+        return "".join(iter_page_texts(pdf_path, backend=backend))
+    except Exception as e:
+        log(f"Error reading PDF {os.path.basename(pdf_path)}: {e}")
+        return None
+
+
+def match_invoice_fields(pdf_text, fields=None):
+    """Search pdf_text for any field not already in fields.
+
+    Fields that are already present are kept as they are, so the same dict
+    can be passed in again with the next page of text.
+    """
+    return RULES.match(pdf_text, fields)
+
+
+def build_invoice_data(fields, pdf_name, log):
+    data = {}
+
+    # 1. Extract Company Code (Sender's Company Abbreviation)
+    company_code = None
+    if RULES.has_senders:
+        if "sender" in fields:
+            found_name_in_pdf = fields["sender"]
+            company_code = RULES.company_code(found_name_in_pdf)
+            if company_code:
+                data["company_code"] = company_code
+            else:
+                log(f"Found text '{found_name_in_pdf}' but could not map to a defined company abbreviation for {pdf_name}.")
+                return None # Indicates failure to extract this part
+        else:
+            log(f"Could not find a known sender company name in {pdf_name}.")
+            return None
+    else:
+        log(f"Company abbreviation map is empty. Cannot determine company code for {pdf_name}.")
+        return None
+
+    # 2. Auto-detect Client and Extract Manifest Number
+    if "client_for_naming" in fields:
+        data["client_for_naming"] = fields["client_for_naming"]
+        data["manifest_num"] = fields["manifest_num"]
+        log(f"Detected client '{data['client_for_naming']}' and Manifest No. '{data['manifest_num']}' for {pdf_name}.")
+    else:
+        clients = RULES.client_names
+        client_list = " or ".join(filter(None, (", ".join(clients[:-1]), clients[-1]))) if clients else "none defined"
+        log(f"Could not detect a client ({client_list}) based on manifest patterns in {pdf_name}.")
+        return None # Indicates failure to extract this part
+
+    # 3. Extract Our Ref Num
+    if "our_ref_num" in fields:
+        data["our_ref_num"] = fields["our_ref_num"]
+    else:
+        log(f"Could not find 'Our Ref Num:' in {pdf_name}.")
+        return None # Indicates failure to extract this part
+
+    return data
+
+
+def extract_invoice_data_for_rename(pdf_text, pdf_name, log):
+    return build_invoice_data(match_invoice_fields(pdf_text), pdf_name, log)
+
+
+def extract_invoice_fields_from_pages(page_texts, fields=None, timings=None):
+    """Match page by page and stop pulling pages once every required field is found.
+
+    Returns (fields, pages_read). Each new page is searched together with
+    the page before it, so a field split over a page break is still found.
+    Matching time goes to timings["match"] when timings is a dict.
+    """
+    if fields is None:
+        fields = {}
+    previous_page_text = ""
+    pages_read = 0
+    for page_text in page_texts:
+        pages_read += 1
+        with timed_stage(timings, "match"):
+            match_invoice_fields(previous_page_text + page_text, fields)
+        if all(field in fields for field in REQUIRED_FIELDS):
+            break
+        previous_page_text = page_text
+    return fields, pages_read
+
+
+def read_invoice_fields(pdf_path, timings=None, text_mode="full", backend=DEFAULT_TEXT_BACKEND):
+    """Read pdf_path and return the fields found, the pages read and any read error.
+
+    This is the part of a result that only depends on the file's content,
+    which is what ExtractionCache stores. In "header" text mode fields are
+    matched in the first page's header regions, and in whole pages only if
+    a field is still missing after that. This narrows where fields are
+    looked for; it isn't faster, as the first page is parsed in full
+    either way. backend names the TEXT_BACKENDS entry
+    that reads the text; they all find the same fields. pdf_path can also
+    be a PdfBuffer holding the file.
+    """
+    if text_mode == "header":
+        return read_invoice_fields_from_header(pdf_path, timings, backend)
+    page_texts = None
+    try:
+        page_texts = iter_page_texts(pdf_path, timings, backend)
+        fields, pages_read = extract_invoice_fields_from_pages(page_texts, timings=timings)
+        return {"fields": fields, "pages_read": pages_read, "error": None}
+    except Exception as e:
+        return {"fields": {}, "pages_read": 0, "error": str(e)}
+    finally:
+        if page_texts is not None:
+            page_texts.close() # Releases the document if we stopped early
+
+
+def read_invoice_fields_from_header(pdf_path, timings=None, backend=DEFAULT_TEXT_BACKEND):
+    text_backend = TEXT_BACKENDS[backend]
+    pdf_doc = None
+    page_texts = None
+    try:
+        with timed_stage(timings, "open"):
+            pdf_doc = text_backend.open(pdf_path)
+        if not text_backend.page_count(pdf_doc):
+            return {"fields": {}, "pages_read": 0, "error": None, "text_source": "header"}
+        fields, first_page_text = read_header_fields(pdf_doc, timings, backend)
+        if first_page_text is None:
+            return {"fields": fields, "pages_read": 1, "error": None, "text_source": "header"}
+        # Something isn't in the header, look for just the missing fields in whole pages
+        page_texts = iter_document_page_texts(pdf_doc, timings, backend, start=1)
+        fields, pages_read = extract_invoice_fields_from_pages(
+            itertools.chain([first_page_text], page_texts), fields, timings
+        )
+        return {"fields": fields, "pages_read": pages_read, "error": None, "text_source": "full"}
+    except Exception as e:
+        return {"fields": {}, "pages_read": 0, "error": str(e)}
+    finally:
+        if page_texts is not None:
+            page_texts.close()
+        if pdf_doc is not None:
+            with timed_stage(timings, "open"):
+                text_backend.close(pdf_doc)
+
+
+def calibrate_text_backends(pdf_path, text_mode="full", repeat=3):
+    """Time each installed backend reading pdf_path the way a run would, returning {name: seconds}.
+
+    Each backend gets the best of repeat reads, or a single one if that was
+    already twice as slow as the fastest so far. Backends that don't find
+    the same fields as DEFAULT_TEXT_BACKEND are left out.
+    """
+    reference = read_invoice_fields(pdf_path, text_mode=text_mode)
+    seconds = {}
+    for name in installed_text_backends():
+        try:
+            TEXT_BACKENDS[name].module # Importing it isn't part of reading
+        except ImportError:
+            continue
+        for attempt in range(repeat):
+            started = time.perf_counter()
+            extraction = read_invoice_fields(pdf_path, text_mode=text_mode, backend=name)
+            elapsed = time.perf_counter() - started
+            if extraction["fields"] != reference["fields"] or extraction["error"] != reference["error"]:
+                seconds.pop(name, None)
+                break
+            seconds[name] = min(seconds.get(name, elapsed), elapsed)
+            if seconds[name] > 2 * min(seconds.values()):
+                break
+    return seconds
+
+
+def extraction_version(text_mode="full"):
+    """What a cached extraction depends on besides the file: the rules, and the regions in "header" mode."""
+    if text_mode == "full":
+        return RULES.version
+    regions = json.dumps([RULES.text_regions, RULES.sender_text_regions], sort_keys=True)
+    return hashlib.sha256(f"{RULES.version}\n{text_mode}\n{regions}".encode("utf-8")).hexdigest()
+
+
+def result_from_extraction(pdf_path, extraction):
+    logs = []
+    pdf_name = os.path.basename(pdf_path)
+    reason_skipped = ""
+    invoice_data = None
+    if extraction["error"] is not None:
+        logs.append(f"Error reading PDF {pdf_name}: {extraction['error']}")
+    if not extraction["pages_read"]:
+        reason_skipped = "Error reading PDF content."
+    else:
+        invoice_data = build_invoice_data(extraction["fields"], pdf_name, logs.append)
+        if not invoice_data:
+            reason_skipped = "Could not extract all required data for renaming."
+    return {
+        "pdf_path": pdf_path,
+        "invoice_data": invoice_data,
+        "reason_skipped": reason_skipped,
+        "logs": logs,
+        "text_source": extraction.get("text_source", "full"),
+    }
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class DuplicateFinder:
+    """Spots PDFs with the same content as one seen earlier, one file at a time.
+
+    A file is only hashed once another file of the same size turns up, so
+    most files are never hashed here. Memory grows with the number of
+    distinct file sizes, not with the number of files. With hash_first,
+    the first file of each size is hashed straight away instead, for
+    when it may be gone, e.g. moved to the output folder, by the time a
+    second one turns up.
+    """
+
+    def __init__(self, hash_first=False):
+        self.hash_first = hash_first
+        self.first_path_by_size = {} # size -> (path, digest or None), until a second file of that size turns up
+        self.paths_by_size = {}      # size -> {digest: first path with that content}
+
+    def check(self, pdf_path):
+        """Return (path of the earlier file with the same content or None, digest or None)."""
+        try:
+            size = os.path.getsize(pdf_path)
+        except OSError:
+            return None, None # Reported when the file is read
+        paths_by_digest = self.paths_by_size.get(size)
+        if paths_by_digest is None:
+            first = self.first_path_by_size.pop(size, None)
+            if first is None:
+                digest = None
+                if self.hash_first:
+                    try:
+                        digest = file_digest(pdf_path)
+                    except OSError:
+                        pass
+                self.first_path_by_size[size] = (pdf_path, digest)
+                return None, digest
+            first_path, first_digest = first
+            paths_by_digest = self.paths_by_size[size] = {}
+            try:
+                paths_by_digest[first_digest or file_digest(first_path)] = first_path
+            except OSError:
+                pass
+        try:
+            digest = file_digest(pdf_path)
+        except OSError:
+            return None, None
+        original_path = paths_by_digest.get(digest)
+        if original_path is None:
+            paths_by_digest[digest] = pdf_path
+        return original_path, digest
+
+
+class ExtractionCache:
+    """Extraction results kept in SQLite and keyed by the SHA-256 of each file.
+
+    A (size, mtime, inode) row per path lets an unchanged file skip hashing
+    as well as parsing. Results from a different rule set are never reused,
+    and once there are more than max_entries results the least recently
+    used ones are dropped when the cache is closed. rules_version is what
+    a stored result depends on besides the file, see extraction_version.
+    """
+
+    def __init__(self, db_path, max_entries=DEFAULT_CACHE_MAX_ENTRIES, read_only=False, rules_version=None):
+        self.db_path = db_path
+        self.rules_version = rules_version or RULES.version
+        self.max_entries = max_entries
+        self.read_only = read_only
+        self.used_digests = set()
+        self.pending_writes = 0
+        if read_only:
+            # As a file: URI, so characters like ? # % in the path are escaped, and drive letters work on Windows
+            self.conn = sqlite3.connect(pathlib.Path(db_path).resolve().as_uri() + "?mode=ro", uri=True)
+        else:
+            self.conn = sqlite3.connect(db_path)
+            self.conn.execute("PRAGMA journal_mode=WAL") # Lets worker processes read while we write
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS extractions ("
+                "digest TEXT NOT NULL, rules_version TEXT NOT NULL, extraction TEXT NOT NULL, "
+                "last_used REAL NOT NULL, PRIMARY KEY (digest, rules_version))"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_keys ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                "inode INTEGER NOT NULL, digest TEXT NOT NULL)"
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def _stat_key(pdf_path):
+        st = os.stat(pdf_path)
+        return os.path.abspath(pdf_path), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def digest_for(self, pdf_path):
+        """The digest recorded for pdf_path, or None if it changed or was never seen."""
+        try:
+            path, size, mtime_ns, inode = self._stat_key(pdf_path)
+        except OSError:
+            return None
+        row = self.conn.execute(
+            "SELECT digest FROM file_keys WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+            (path, size, mtime_ns, inode),
+        ).fetchone()
+        return row[0] if row else None
+
+    def get(self, digest):
+        row = self.conn.execute(
+            "SELECT extraction FROM extractions WHERE digest = ? AND rules_version = ?",
+            (digest, self.rules_version),
+        ).fetchone()
+        if row is None:
+            return None
+        if not self.read_only: # Workers' hits are recorded by the main process
+            self.used_digests.add(digest)
+        return json.loads(row[0])
+
+    def record(self, pdf_path, result):
+        """Remember the digest and, for a freshly parsed file, the extraction in result."""
+        if not result.get("digest"):
+            return
+        digest = result["digest"]
+        try:
+            path, size, mtime_ns, inode = self._stat_key(pdf_path)
+        except OSError:
+            return
+        self.conn.execute(
+            "INSERT OR REPLACE INTO file_keys (path, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?)",
+            (path, size, mtime_ns, inode, digest),
+        )
+        if result.get("from_cache"):
+            self.used_digests.add(digest)
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extractions (digest, rules_version, extraction, last_used) VALUES (?, ?, ?, ?)",
+                (digest, self.rules_version, json.dumps(result["extraction"]), time.time()),
+            )
+        self.pending_writes += 1
+        if self.pending_writes >= 100:
+            self.commit()
+
+    def commit(self):
+        """Write pending results and last-used times, so the set of used digests stays small."""
+        if self.used_digests:
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE extractions SET last_used = ? WHERE digest = ?",
+                ((now, digest) for digest in self.used_digests),
+            )
+            self.used_digests.clear()
+        self.conn.commit()
+        self.pending_writes = 0
+
+    def evict(self):
+        self.conn.execute(
+            "DELETE FROM extractions WHERE rowid IN "
+            "(SELECT rowid FROM extractions ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self.conn.execute("DELETE FROM file_keys WHERE digest NOT IN (SELECT digest FROM extractions)")
+
+    def close(self):
+        if not self.read_only:
+            self.commit()
+            self.evict()
+            self.conn.commit()
+        self.conn.close()
+
+
+def reflink_file(src, dst):
+    """Clone src to dst sharing the same disk blocks (Btrfs, XFS and similar)."""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+    with open(src, "rb") as src_file, open(dst, "xb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def partial_path(dst):
+    """Where a file bound for dst is written before it is moved into place."""
+    directory, filename = os.path.split(dst)
+    return os.path.join(directory, f".{filename}.{os.getpid()}{PARTIAL_SUFFIX}")
+
+
+def write_into_place(dst, write):
+    """Call write with a temporary path next to dst, then rename that file to dst.
+
+    dst either doesn't exist or is complete, however the write ends.
+    """
+    temp_path = partial_path(dst)
+    try:
+        write(temp_path)
+        os.replace(temp_path, dst)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_file(path):
+    """Delete path if it is still there, ignoring errors."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def remove_partial_files(directory):
+    """Delete files an interrupted run left half written in directory, returning how many."""
+    removed = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") and entry.name.endswith(PARTIAL_SUFFIX) and entry.is_file():
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+
+def place_file(src, dst, strategy="copy"):
+    """Put src at dst with strategy, falling back when the filesystem can't do it.
+
+    Returns (strategy_used, bytes_written). Links and moves within one
+    filesystem write no file data, so they count as 0 bytes. Copies and
+    clones are written under a temporary name first, so an interrupted run
+    never leaves a half written file under dst.
+    """
+    fallbacks = OUTPUT_STRATEGY_FALLBACKS[strategy]
+    for candidate in fallbacks:
+        try:
+            if candidate == "hardlink":
+                os.link(src, dst)
+                return candidate, 0
+            if candidate == "reflink":
+                write_into_place(dst, lambda temp_path: reflink_file(src, temp_path))
+                return candidate, 0
+            if candidate == "move":
+                os.rename(src, dst)
+                return candidate, 0
+            if candidate == "copy and delete":
+                write_into_place(dst, lambda temp_path: shutil.copy2(src, temp_path))
+                os.remove(src)
+                return candidate, os.path.getsize(dst)
+            write_into_place(dst, lambda temp_path: shutil.copy2(src, temp_path))
+            return candidate, os.path.getsize(dst)
+        except OSError:
+            if candidate == fallbacks[-1]:
+                raise
+
+
+def store_file(src, dst, strategy="copy", staged_path=None):
+    """place_file, timed, returning (output, seconds, error) instead of raising.
+
+    output is place_file's (strategy_used, bytes_written), or None when it
+    failed with error. A staged_path already holding a copy of src, on the
+    same filesystem, is renamed to dst instead of copying src again.
+    """
+    started = time.perf_counter()
+    try:
+        output = None
+        if staged_path is not None:
+            try:
+                os.replace(staged_path, dst)
+                output = ("copy", os.path.getsize(dst))
+            except OSError:
+                remove_file(staged_path)
+        if output is None:
+            output = place_file(src, dst, strategy)
+    except Exception as e:
+        return None, time.perf_counter() - started, e
+    return output, time.perf_counter() - started, None
+
+
+def output_size(path):
+    """Size of the file at path, or None if there is no path or no file."""
+    if not path:
+        return None
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def same_content(path, other_path):
+    try:
+        return filecmp.cmp(path, other_path, shallow=False)
+    except OSError:
+        return False
+
+
+def format_bytes(num_bytes):
+    for unit in ("bytes", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes} {unit}" if unit == "bytes" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+
+
+def format_output_totals(output_totals):
+    """E.g. '120 hardlink, 3 copy; 1.2 MB written'."""
+    counts = ", ".join(f"{count} {strategy}" for strategy, count in output_totals["strategies"].items())
+    return f"{counts or 'no files'}; {format_bytes(output_totals['bytes_written'])} written"
+
+
+def parse_shard_levels(text):
+    """("client", "month") for "client,month"; an empty string keeps every renamed file in one folder."""
+    levels = tuple(level.strip() for level in text.split(",") if level.strip())
+    for level in levels:
+        if level not in SHARD_LEVELS:
+            raise ValueError(f"unknown level '{level}', choose from {', '.join(SHARD_LEVELS)}")
+    if len(set(levels)) != len(levels):
+        raise ValueError("each level can only be used once")
+    return levels
+
+
+def shard_folders(levels, invoice_data, pdf_path):
+    """The subfolders, outermost first, that a renamed file goes in under levels."""
+    folders = []
+    for level in levels:
+        if level == "client":
+            folder = invoice_data["client_for_naming"]
+        elif level == "company":
+            folder = invoice_data["company_code"]
+        else:
+            try:
+                folder = datetime.fromtimestamp(os.path.getmtime(pdf_path)).strftime("%Y-%m")
+            except OSError:
+                folder = "Unknown Month"
+        # Windows drops trailing dots and spaces from folder names
+        folders.append(re.sub(r'[\\/*?:"<>|]', "_", str(folder)).rstrip(" .") or "_")
+    return folders
+
+
+class NameIndex:
+    """The file names in one output folder, listed once the first time a run writes there.
+
+    Collision suffixes come from a counter per base name, so the hundredth
+    copy of a manifest gets its _100 without probing _1 to _99 on the share.
+    Names are compared with os.path.normcase, matching how Windows treats them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with os.scandir(directory) as entries:
+            self.taken = {os.path.normcase(entry.name) for entry in entries}
+        self.next_suffix = {}
+
+    def reserve(self, base_name, ext):
+        """Claim base_name + ext, or the first free base_name_N + ext, and return it."""
+        filename = f"{base_name}{ext}"
+        if os.path.normcase(filename) in self.taken:
+            counter = self.next_suffix.get(os.path.normcase(base_name + ext), 1)
+            while os.path.normcase(filename) in self.taken:
+                filename = f"{base_name}_{counter}{ext}"
+                counter += 1
+            self.next_suffix[os.path.normcase(base_name + ext)] = counter
+        self.taken.add(os.path.normcase(filename))
+        return filename
+
+    def existing(self, base_name, ext):
+        """Yield base_name + ext, base_name_1 + ext and so on, for as long as they are taken."""
+        filename = f"{base_name}{ext}"
+        counter = 1
+        while os.path.normcase(filename) in self.taken:
+            yield filename
+            filename = f"{base_name}_{counter}{ext}"
+            counter += 1
+
+
+# One read-only connection per worker process, opened on first use. When
+# iter_processed_pdfs reads in the main process it closes them again, so no
+# connection outlives the run or is inherited by workers forked later.
+_worker_caches = {}
+
+
+def close_worker_caches():
+    """Close the read-only cache connections process_pdf opened in this process."""
+    while _worker_caches:
+        _, worker_cache = _worker_caches.popitem()
+        try:
+            worker_cache.close()
+        except sqlite3.Error:
+            pass
+
+
+def process_pdf(pdf_path, cache_path=None, digest=None, timed=False, text_mode="full", backend=DEFAULT_TEXT_BACKEND,
+                single_read=False, stage_dir=None):
+    """Read one PDF and pull out the fields needed to rename it.
+
+    Log lines are collected instead of printed so the result can come back
+    from a worker process as a plain dict. With a cache_path the file is
+    hashed (unless digest is already known) and a cached extraction for the
+    same content is used instead of parsing it again. With timed, the
+    seconds spent in each stage are returned in result["stage_seconds"].
+    text_mode and backend are passed on to read_invoice_fields.
+
+    With single_read the file is read once into a PdfBuffer, which is
+    hashed and parsed from memory. With a stage_dir as well, the buffer is
+    also written to a partial file there, whose path comes back in
+    result["staged_path"] for the caller to move into place instead of
+    reading the file a third time to copy it.
+    """
+    started = time.perf_counter()
+    timings = {} if timed else None
+    source = pdf_path
+    if single_read:
+        try:
+            with timed_stage(timings, "open"):
+                source = PdfBuffer(pdf_path)
+        except OSError:
+            pass # Read from the path below, which fails with a proper message
+    try:
+        result = process_pdf_source(pdf_path, source, cache_path, digest, timings, text_mode, backend)
+        if stage_dir is not None and isinstance(source, PdfBuffer):
+            try:
+                with timed_stage(timings, "write"):
+                    result["staged_path"] = source.write_copy(stage_dir)
+            except OSError as e:
+                result["logs"].append(f"Could not write {os.path.basename(pdf_path)} from memory, copying it instead: {e}")
+    finally:
+        if isinstance(source, PdfBuffer):
+            source.close()
+    result["read_seconds"] = time.perf_counter() - started
+    if timed:
+        result["stage_seconds"] = timings
+    return result
+
+
+def process_pdf_source(pdf_path, source, cache_path, digest, timings, text_mode, backend):
+    """process_pdf's reading, from source, which is pdf_path or a PdfBuffer of it."""
+    if cache_path is None:
+        result = result_from_extraction(pdf_path, read_invoice_fields(source, timings, text_mode, backend))
+    else:
+        extraction = None
+        try:
+            if digest is None:
+                with timed_stage(timings, "hash"):
+                    digest = source.digest() if isinstance(source, PdfBuffer) else file_digest(pdf_path)
+            cache_key = (cache_path, text_mode)
+            if cache_key not in _worker_caches:
+                _worker_caches[cache_key] = ExtractionCache(
+                    cache_path, read_only=True, rules_version=extraction_version(text_mode)
+                )
+            extraction = _worker_caches[cache_key].get(digest)
+        except (OSError, sqlite3.Error):
+            pass # Unreadable files fail again below with a proper message, and a broken cache is just a miss
+        from_cache = extraction is not None
+        if not from_cache:
+            extraction = read_invoice_fields(source, timings, text_mode, backend)
+        result = result_from_extraction(pdf_path, extraction)
+        result.update(digest=digest, extraction=extraction, from_cache=from_cache)
+    return result
+
+
+def worker_failed_result(pdf_path, error):
+    if isinstance(error, ReadAborted):
+        return {
+            "pdf_path": pdf_path,
+            "invoice_data": None,
+            "reason_skipped": f"Reading stopped by the watchdog: {error}.",
+            "logs": [],
+            "read_aborted": True,
+        }
+    return {
+        "pdf_path": pdf_path,
+        "invoice_data": None,
+        "reason_skipped": f"Worker failed while reading PDF: {error}.",
+        "logs": [],
+    }
+
+
+def process_pdf_in_worker(*args):
+    """process_pdf for a pool worker, which also reports how much memory the worker is using."""
+    result = process_pdf(*args)
+    result["worker_memory"] = (os.getpid(), current_rss())
+    return result
+
+
+class ReadLimits:
+    """How long and how much memory reading one PDF may take, and how often workers are replaced."""
+
+    def __init__(self, timeout=DEFAULT_READ_TIMEOUT, cpu_seconds=DEFAULT_READ_CPU_SECONDS, memory_limit=None,
+                 recycle_after=DEFAULT_RECYCLE_AFTER):
+        self.timeout = timeout or None # Wall-clock seconds per PDF
+        self.cpu_seconds = cpu_seconds or None # CPU seconds per PDF (RLIMIT_CPU)
+        self.memory_limit = memory_limit or None # Bytes of address space per worker (RLIMIT_AS)
+        self.recycle_after = recycle_after or None # PDFs per worker before it is replaced
+
+    @property
+    def isolate(self):
+        """Whether PDFs have to be read in worker processes, even with a single worker."""
+        return bool(self.timeout or self.cpu_seconds or self.memory_limit)
+
+    def describe(self):
+        """E.g. '120 s, 60 s of CPU or 512.0 MB of memory'."""
+        limits = []
+        if self.timeout:
+            limits.append(f"{self.timeout:g} s")
+        if self.cpu_seconds and resource is not None:
+            limits.append(f"{self.cpu_seconds:g} s of CPU")
+        if self.memory_limit and resource is not None:
+            limits.append(f"{format_bytes(self.memory_limit)} of memory")
+        if len(limits) < 2:
+            return "".join(limits) or "no limit"
+        return f"{', '.join(limits[:-1])} or {limits[-1]}"
+
+
+class ReadAborted(Exception):
+    """A worker was stopped, or died, while reading a PDF."""
+
+
+def set_soft_limit(limit, value):
+    """Lower or raise the soft resource limit to value, keeping it under the hard limit."""
+    _, hard = resource.getrlimit(limit)
+    resource.setrlimit(limit, (value if hard == resource.RLIM_INFINITY else min(value, hard), hard))
+
+
+def watchdog_worker(conn, cpu_seconds, memory_limit):
+    """Run the (fn, args) jobs WatchdogPool sends over conn, one at a time, until it sends None."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is for the parent, which stops the workers
+    if resource is not None:
+        set_soft_limit(resource.RLIMIT_CORE, 0) # A PDF that kills its worker shouldn't leave a core dump too
+        if memory_limit:
+            set_soft_limit(resource.RLIMIT_AS, memory_limit)
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        fn, args = job
+        if resource is not None and cpu_seconds:
+            # RLIMIT_CPU counts the whole process, so each job gets cpu_seconds on top of what is used so far
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            set_soft_limit(resource.RLIMIT_CPU, math.ceil(usage.ru_utime + usage.ru_stime + cpu_seconds))
+        try:
+            outcome = ("done", fn(*args))
+        except MemoryError:
+            outcome = ("out of memory", None)
+        except Exception as e:
+            outcome = ("failed", f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        conn.send(outcome)
+
+
+class WatchdogWorker:
+    """One watchdog_worker process and the job it is on."""
+
+    def __init__(self, limits):
+        self.conn, child_conn = multiprocessing.Pipe()
+        # Spawned, as on Windows, rather than forked: workers are started from the watchdog thread, and a fork
+        # there copies any SQLite lock the main thread holds at that moment, hanging the worker until it is killed
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=watchdog_worker, args=(child_conn, limits.cpu_seconds, limits.memory_limit), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.future = None # The job being worked on
+        self.started = None # time.monotonic() when it was handed over
+        self.done_count = 0
+
+
+class WatchdogPool:
+    """Worker processes that read one PDF at a time each, under ReadLimits.
+
+    A worker whose PDF runs past limits.timeout is killed, and each worker
+    caps its own CPU seconds per PDF and its address space, so a PDF that
+    spins or balloons only takes its own worker down: that PDF's Future
+    fails with ReadAborted and a fresh worker carries on with the rest.
+    Unlike a ProcessPoolExecutor, a dead worker doesn't break the pool.
+    Workers are also replaced after limits.recycle_after PDFs, which hands
+    back whatever memory the PDF library held on to. submit and shutdown
+    work like an Executor's.
+    """
+
+    def __init__(self, max_workers, limits):
+        self.max_workers = max_workers
+        self.limits = limits
+        self.jobs = deque() # (Future, fn, args) waiting for a worker
+        self.workers = []
+        self.closing = False
+        self.cancel_futures = False
+        self.aborted_count = 0
+        self.recycled_count = 0
+        self.lock = threading.Lock()
+        self.wakeup_reader, self.wakeup_writer = multiprocessing.Pipe(duplex=False)
+        self.thread = threading.Thread(target=self.manage, name="doby-watchdog", daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown(wait=True, cancel_futures=True)
+
+    def submit(self, fn, *args):
+        future = Future()
+        with self.lock:
+            if self.closing:
+                raise RuntimeError("cannot submit after shutdown")
+            self.jobs.append((future, fn, args))
+            self.wakeup_writer.send_bytes(b"")
+        return future
+
+    def pids(self):
+        """The process ids of the workers alive right now."""
+        return [worker.process.pid for worker in list(self.workers)]
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        """Stop taking jobs and stop the workers once the queued jobs are done.
+
+        With cancel_futures, queued jobs are cancelled and workers still
+        reading are killed instead of waited for.
+        """
+        with self.lock:
+            if not self.closing:
+                self.closing = True
+                self.cancel_futures = cancel_futures
+                self.wakeup_writer.send_bytes(b"")
+        if wait:
+            self.thread.join()
+
+    def manage(self):
+        """Hand out jobs, collect results and enforce the timeout, on the pool's own thread."""
+        try:
+            while True:
+                with self.lock:
+                    if self.closing and self.cancel_futures:
+                        for future, _, _ in self.jobs:
+                            future.cancel()
+                        self.jobs.clear()
+                        for worker in [worker for worker in self.workers if worker.future is not None]:
+                            self.abort(worker, "the run was stopped")
+                    if self.closing and not self.jobs and not any(worker.future for worker in self.workers):
+                        break
+                    self.hand_out_jobs()
+                busy = [worker for worker in self.workers if worker.future is not None]
+                timeout = None
+                if self.limits.timeout and busy:
+                    timeout = max(0, min(worker.started for worker in busy) + self.limits.timeout - time.monotonic())
+                ready = wait_for_connections(
+                    [self.wakeup_reader] + [worker.conn for worker in busy] + [worker.process.sentinel for worker in self.workers],
+                    timeout
+                )
+                while self.wakeup_reader.poll():
+                    self.wakeup_reader.recv_bytes()
+                for worker in list(self.workers):
+                    if worker.future is not None and worker.conn in ready:
+                        self.collect(worker)
+                    elif worker.process.sentinel in ready:
+                        self.ended(worker)
+                if self.limits.timeout:
+                    now = time.monotonic()
+                    for worker in busy:
+                        if worker.future is not None and now - worker.started >= self.limits.timeout:
+                            self.abort(worker, f"took longer than {self.limits.timeout:g} s")
+        finally:
+            for worker in list(self.workers):
+                self.stop(worker)
+
+    def hand_out_jobs(self):
+        idle = [worker for worker in self.workers if worker.future is None]
+        while self.jobs and (idle or len(self.workers) < self.max_workers):
+            future, fn, args = self.jobs.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            if not idle:
+                try:
+                    idle.append(WatchdogWorker(self.limits))
+                except OSError as e:
+                    future.set_exception(e)
+                    continue
+                self.workers.append(idle[-1])
+            worker = idle.pop()
+            try:
+                worker.conn.send((fn, args))
+            except (OSError, ValueError) as e: # The worker died while idle, or the job can't be pickled
+                future.set_exception(e)
+                continue
+            worker.future = future
+            worker.started = time.monotonic()
+
+    def collect(self, worker):
+        try:
+            status, value = worker.conn.recv()
+        except (EOFError, OSError):
+            self.ended(worker)
+            return
+        future, worker.future = worker.future, None
+        worker.done_count += 1
+        if status == "out of memory":
+            # Failed like a killed job, and the worker is replaced as its heap may be in a bad way
+            self.aborted_count += 1
+            future.set_exception(ReadAborted(f"needed more than {format_bytes(self.limits.memory_limit)} of memory"
+                                             if self.limits.memory_limit else "ran out of memory"))
+            self.stop(worker)
+            return
+        if status == "done":
+            future.set_result(value)
+        else:
+            future.set_exception(RuntimeError(value))
+        if self.limits.recycle_after and worker.done_count >= self.limits.recycle_after:
+            self.recycled_count += 1
+            self.stop(worker)
+
+    def ended(self, worker):
+        """Drop a worker whose process exited or closed its end of the pipe, saying why."""
+        worker.process.join(5) # Its pipe can close a moment before it can be waited for
+        if worker.process.exitcode is None:
+            self.abort(worker, "the worker stopped answering")
+        else:
+            self.remove(worker, self.exit_reason(worker.process.exitcode))
+
+    def exit_reason(self, exitcode):
+        if exitcode < 0:
+            if hasattr(signal, "SIGXCPU") and -exitcode == signal.SIGXCPU:
+                return f"used more than {self.limits.cpu_seconds:g} s of CPU"
+            try:
+                signal_name = signal.Signals(-exitcode).name
+            except ValueError:
+                signal_name = f"signal {-exitcode}"
+            hint = " (it may have gone over the memory limit)" if self.limits.memory_limit else ""
+            return f"the worker was stopped by {signal_name}{hint}"
+        return f"the worker exited with code {exitcode}"
+
+    def abort(self, worker, reason):
+        worker.process.kill()
+        worker.process.join()
+        self.remove(worker, reason)
+
+    def remove(self, worker, reason):
+        """Drop a worker that has ended, failing the job it was on with reason."""
+        if worker in self.workers:
+            self.workers.remove(worker)
+        worker.conn.close()
+        if worker.future is not None:
+            self.aborted_count += 1
+            worker.future.set_exception(ReadAborted(reason))
+            worker.future = None
+
+    def stop(self, worker):
+        """Let an idle worker exit, killing it if it doesn't."""
+        try:
+            worker.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        worker.process.join(5)
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join()
+        self.remove(worker, "the worker was stopped")
+
+
+def iter_processed_pdfs(pdf_paths, max_workers=None, cache=None, timed=False, text_mode="full", digests=None,
+                        memory_limit=None, log=None, queue_depths=None, backend=DEFAULT_TEXT_BACKEND, read_limits=None,
+                        single_read=False, stage_dir=None):
+    """Run process_pdf over pdf_paths, yielding (index, result) in input order.
+
+    pdf_paths can be any iterable, a generator included, and is only pulled
+    from as far as needed: at most READ_AHEAD_PER_WORKER PDFs per worker
+    are read ahead of the one the caller is waiting for. Files the cache
+    already knows by path, size, mtime and inode are answered without being
+    read. With a single worker everything runs in this process. digests can
+    map an index to the SHA-256 of a file already hashed, and entries are
+    removed as they are used. With memory_limit (bytes), no more PDFs are
+    handed to the workers while this process and its workers together are
+    above it, unless nothing else is being read. queue_depths, a
+    QueueDepths, gets a "read" sample each time a result is yielded.
+    PDFs are read on a WatchdogPool under read_limits, a ReadLimits, and
+    any that go over them come back as skipped with result["read_aborted"];
+    with limits, a single worker still reads in its own process.
+    single_read and stage_dir are passed on to process_pdf; files answered
+    from the cache here aren't read at all, so they have no staged copy.
+    """
+    if max_workers is None:
+        max_workers = default_worker_count()
+    cache_path = cache.db_path if cache is not None else None
+    if cache is not None:
+        cache.commit() # So worker processes can see everything recorded so far
+
+    def cached_result(index, pdf_path):
+        digest = digests.pop(index, None) if digests is not None else None
+        if cache is None:
+            return None, digest
+        digest = digest or cache.digest_for(pdf_path)
+        extraction = cache.get(digest) if digest else None
+        if extraction is None:
+            return None, digest
+        result = result_from_extraction(pdf_path, extraction)
+        result.update(digest=digest, extraction=extraction, from_cache=True)
+        return result, digest
+
+    if read_limits is None:
+        read_limits = ReadLimits(timeout=None, cpu_seconds=None, recycle_after=None)
+
+    if max_workers <= 1 and not read_limits.isolate:
+        try:
+            for index, pdf_path in enumerate(pdf_paths):
+                result, digest = cached_result(index, pdf_path)
+                if result is None:
+                    result = process_pdf(pdf_path, cache_path, digest, timed, text_mode, backend, single_read, stage_dir)
+                if cache is not None:
+                    cache.record(pdf_path, result)
+                yield index, result
+        finally:
+            close_worker_caches()
+        return
+
+    worker_memory = {} # pid -> bytes, as last reported by each worker
+    throttled = False
+
+    def over_memory_limit():
+        nonlocal throttled
+        if memory_limit is None:
+            return False
+        if executor is not None:
+            live_pids = set(executor.pids())
+            for pid in [pid for pid in worker_memory if pid not in live_pids]:
+                del worker_memory[pid] # Recycled or killed since it last reported
+        used = (current_rss() or 0) + sum(rss or 0 for rss in worker_memory.values())
+        if (used > memory_limit) != throttled:
+            throttled = not throttled
+            if log is not None:
+                log(f"Memory use is {format_bytes(used)}, "
+                    + ("reading fewer PDFs at once." if throttled else "back to reading at full speed."))
+        return throttled
+
+    read_ahead = max_workers * READ_AHEAD_PER_WORKER
+    pending = {} # index -> (path, Future), or (path, result) for cache hits
+    paths = enumerate(pdf_paths)
+    next_index = 0
+    executor = None
+    try:
+        while True:
+            while len(pending) < read_ahead and not (pending and over_memory_limit()):
+                index, pdf_path = next(paths, (None, None))
+                if index is None:
+                    break
+                result, digest = cached_result(index, pdf_path)
+                if result is None:
+                    if executor is None:
+                        executor = WatchdogPool(max_workers, read_limits)
+                    result = executor.submit(
+                        process_pdf_in_worker, pdf_path, cache_path, digest, timed, text_mode, backend, single_read, stage_dir
+                    )
+                pending[index] = (pdf_path, result)
+            if next_index not in pending:
+                return
+            pdf_path, result = pending.pop(next_index)
+            if isinstance(result, Future):
+                try:
+                    result = result.result()
+                    worker_memory.update([result.pop("worker_memory")])
+                except Exception as e: # Over the read limits, or the worker died
+                    result = worker_failed_result(pdf_path, e)
+            if cache is not None:
+                cache.record(pdf_path, result)
+            if queue_depths is not None:
+                queue_depths.sample("read", (item for _, item in pending.values()), read_ahead)
+            yield next_index, result
+            next_index += 1
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True) # If the caller stopped early, drop what is queued and stop what is being read
+
+
+class QueueDepths:
+    """How full each pipeline queue was, sampled once per file, for tuning the queue sizes.
+
+    A queue that stays full of finished items is waiting on the stage after
+    it; one that stays full of unfinished items is waiting on its own stage.
+    """
+
+    def __init__(self):
+        self.queues = {} # name -> {"samples", "depth", "done", "max", "capacity"}
+
+    def sample(self, name, items, capacity):
+        """Count items, each a Future or an outcome that was ready straight away, as one sample of queue name."""
+        queue = self.queues.setdefault(name, {"samples": 0, "depth": 0, "done": 0, "max": 0, "capacity": capacity})
+        depth = 0
+        done = 0
+        for item in items:
+            depth += 1
+            if not isinstance(item, Future) or item.done():
+                done += 1
+        queue["samples"] += 1
+        queue["depth"] += depth
+        queue["done"] += done
+        queue["max"] = max(queue["max"], depth)
+
+    def summary(self):
+        return {
+            name: {
+                "capacity": queue["capacity"],
+                "mean_depth": round(queue["depth"] / queue["samples"], 2),
+                "mean_done": round(queue["done"] / queue["samples"], 2),
+                "max_depth": queue["max"],
+            }
+            for name, queue in self.queues.items()
+        }
+
+    def describe(self):
+        return "; ".join(
+            f"{name} {queue['mean_depth']:.1f} of {queue['capacity']} on average ({queue['mean_done']:.1f} finished), "
+            f"at most {queue['max_depth']}"
+            for name, queue in self.summary().items()
+        )
+
+
+class RunJournal:
+    """Append-only JSON Lines record of a run, one line per file as it is stored.
+
+    Lines are flushed straight away so the journal can be tailed while the
+    run is going, and fsynced every fsync_every records or fsync_interval
+    seconds so a crash loses at most the last few.
+    """
+
+    def __init__(self, path, fsync_every=50, fsync_interval=2.0):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = open(path, "a", encoding="utf-8")
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def append(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+
+def read_journal(path, statuses=None):
+    """Yield the records in a journal, optionally only those with one of statuses."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break # Half-written last line from a crash
+            record = json.loads(line)
+            if statuses is None or record.get("status") in statuses:
+                yield record
+
+
+def timestamped_path(directory, prefix, ext):
+    """prefix + the current time + ext in directory, with a _N suffix if a run this second took it."""
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    path = os.path.join(directory, f"{prefix}{stamp}{ext}")
+    counter = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{prefix}{stamp}_{counter}{ext}")
+        counter += 1
+    return path
+
+
+def latest_journal(directory):
+    """The journal of the most recent run in directory, or None if there isn't one."""
+    journal_paths = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith(JOURNAL_PREFIX) and entry.name.endswith(".jsonl") and entry.is_file():
+                journal_paths.append((entry.stat().st_mtime, entry.path))
+    return max(journal_paths)[1] if journal_paths else None
+
+
+def run_finished(journal_path):
+    """Whether the run that wrote journal_path got to the end of its files, i.e. there is nothing to resume."""
+    last_record = None
+    for last_record in read_journal(journal_path):
+        pass
+    return last_record is not None and last_record.get("status") == "run finished" and not last_record.get("cancelled")
+
+
+def source_key(pdf_path):
+    return os.path.normcase(os.path.abspath(pdf_path))
+
+
+class Checkpoint:
+    """The files an earlier, possibly interrupted, run finished, read back from its journal.
+
+    A renamed or skipped file only counts as finished while its output is
+    still there at the size the journal recorded. Otherwise the file is
+    read and stored again, and its output is deleted first, but only once
+    the file turns up among the PDFs being renamed: output of a file the
+    run no longer selects is left alone. Skipping a finished file takes
+    one dict lookup, without opening or hashing it.
+    """
+
+    STATUSES = ("renamed", "skipped", "duplicate")
+
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.records = []  # The finished files, in journal order
+        self.remaining = {} # source_key -> times it was finished and not yet seen again
+        self.targets = set() # Normalised output paths that belong to a journaled file
+        self.cut_short = {} # source_key -> outputs not at their journaled size, deleted when the file is redone
+        self.redo_count = 0
+        for record in read_journal(journal_path, self.STATUSES):
+            if not self.verify(record):
+                self.redo_count += 1
+                if record.get("target"):
+                    self.cut_short.setdefault(source_key(record["source"]), []).append(record["target"])
+                continue
+            self.records.append(record)
+            key = source_key(record["source"])
+            self.remaining[key] = self.remaining.get(key, 0) + 1
+            if record.get("target"):
+                self.targets.add(os.path.normcase(record["target"]))
+
+    @staticmethod
+    def verify(record):
+        if record["status"] == "duplicate":
+            return True
+        target_path = record.get("target")
+        if not target_path:
+            return False # Never made it to the output folder
+        try:
+            size = os.path.getsize(target_path)
+        except OSError:
+            return False
+        return record.get("size") is None or size == record["size"]
+
+    def take(self, pdf_path):
+        """Return True, once per finished copy, if pdf_path was finished before."""
+        key = source_key(pdf_path)
+        remaining = self.remaining.get(key)
+        if not remaining:
+            for target_path in self.cut_short.pop(key, ()):
+                try:
+                    os.remove(target_path) # Cut short, so it is written again
+                except OSError:
+                    pass
+            return False
+        self.remaining[key] = remaining - 1
+        return True
+
+    def rewrite_journal(self):
+        """Replace the journal with just the finished files, so the run can carry on appending to it."""
+        temp_path = f"{self.journal_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.journal_path)
+
+
+class StageTimings:
+    """Histograms of how long each stage took per file, plus the slowest files.
+
+    Stages are "hash", "open", "text", "match" and "write". Only the
+    slowest_count slowest files are kept whole; every per-file breakdown is
+    in the run journal already. The report includes queue_depths, a
+    QueueDepths, when there is one.
+    """
+
+    STAGES = ("hash", "open", "text", "match", "write")
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, slowest_count=10, queue_depths=None):
+        self.slowest_count = slowest_count
+        self.queue_depths = queue_depths
+        self.started = time.time()
+        self.file_count = 0
+        self.stages = {
+            stage: {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(self.BUCKETS)}
+            for stage in self.STAGES
+        }
+        self.slowest = [] # Min-heap of (total, file number, source, stage_seconds)
+
+    def add(self, source, stage_seconds):
+        self.file_count += 1
+        for stage, seconds in stage_seconds.items():
+            histogram = self.stages[stage]
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+            for i, upper_bound in enumerate(self.BUCKETS):
+                if seconds <= upper_bound:
+                    histogram["buckets"][i] += 1
+                    break
+        entry = (sum(stage_seconds.values()), self.file_count, source, stage_seconds)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif self.slowest and entry[0] > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    def slowest_files(self):
+        return [
+            {"source": source, "total_seconds": round(total, 6),
+             "stages": {stage: round(seconds, 6) for stage, seconds in stage_seconds.items()}}
+            for total, _, source, stage_seconds in sorted(self.slowest, reverse=True)
+        ]
+
+    def report(self):
+        stages = {}
+        for stage, histogram in self.stages.items():
+            cumulative = 0
+            buckets = {}
+            for upper_bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                cumulative += count
+                buckets[str(upper_bound)] = cumulative
+            buckets["+Inf"] = histogram["count"]
+            stages[stage] = {
+                "count": histogram["count"],
+                "sum_seconds": round(histogram["sum"], 6),
+                "mean_seconds": round(histogram["sum"] / histogram["count"], 6) if histogram["count"] else 0.0,
+                "max_seconds": round(histogram["max"], 6),
+                "buckets": buckets,
+            }
+        return {
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "run_seconds": round(time.time() - self.started, 3),
+            "files": self.file_count,
+            "stages": stages,
+            "queues": self.queue_depths.summary() if self.queue_depths is not None else {},
+            "slowest": self.slowest_files(),
+        }
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_prometheus(self, path, run_labels=None):
+        """Write the histograms in the Prometheus text format, e.g. for node_exporter's textfile collector.
+
+        The file is written next to path and then renamed over it, so a
+        scrape never sees half a file.
+        """
+        report = self.report()
+        lines = [
+            "# HELP doby_stage_seconds Seconds spent on one PDF in each stage of a DobY rename run.",
+            "# TYPE doby_stage_seconds histogram",
+        ]
+        for stage, summary in report["stages"].items():
+            for upper_bound, count in summary["buckets"].items():
+                lines.append(f'doby_stage_seconds_bucket{{stage="{stage}",le="{upper_bound}"}} {count}')
+            lines.append(f'doby_stage_seconds_sum{{stage="{stage}"}} {summary["sum_seconds"]}')
+            lines.append(f'doby_stage_seconds_count{{stage="{stage}"}} {summary["count"]}')
+        lines += [
+            "# HELP doby_run_files Files handled by the last DobY rename run, by outcome.",
+            "# TYPE doby_run_files gauge",
+        ]
+        for status, count in (run_labels or {}).items():
+            lines.append(f'doby_run_files{{status="{status}"}} {count}')
+        lines += [
+            "# HELP doby_queue_depth Mean number of files in each pipeline queue during the last DobY rename run.",
+            "# TYPE doby_queue_depth gauge",
+        ]
+        for queue, summary in report["queues"].items():
+            lines.append(f'doby_queue_depth{{queue="{queue}",state="all"}} {summary["mean_depth"]}')
+            lines.append(f'doby_queue_depth{{queue="{queue}",state="finished"}} {summary["mean_done"]}')
+            lines.append(f'doby_queue_depth{{queue="{queue}",state="capacity"}} {summary["capacity"]}')
+        lines += [
+            "# HELP doby_run_seconds Wall clock length of the last DobY rename run.",
+            "# TYPE doby_run_seconds gauge",
+            f"doby_run_seconds {report['run_seconds']}",
+            "# HELP doby_run_finished_timestamp_seconds When the last DobY rename run finished.",
+            "# TYPE doby_run_finished_timestamp_seconds gauge",
+            f"doby_run_finished_timestamp_seconds {time.time():.0f}",
+        ]
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+
+class RenameOptions:
+    """Settings for one renaming run, shared by the window and anything else driving it."""
+
+    def __init__(self, base_renamed_invoices_dir, max_workers=None, use_cache=True, output_strategy="copy",
+                 collect_timings=False, metrics_textfile=None, slowest_count=10, text_mode="full",
+                 skip_duplicates=True, max_rss_mb=None, resume=False, write_workers=DEFAULT_WRITE_WORKERS,
+                 text_backend=DEFAULT_TEXT_BACKEND, shard_by=(), read_timeout=DEFAULT_READ_TIMEOUT,
+                 read_cpu_seconds=DEFAULT_READ_CPU_SECONDS, read_memory_mb=None, recycle_after=DEFAULT_RECYCLE_AFTER,
+                 single_read=False):
+        self.base_renamed_invoices_dir = base_renamed_invoices_dir # Base directory for all output
+        self.successfully_renamed_dir = base_renamed_invoices_dir # Renamed files go here
+        self.not_renamed_dir = os.path.join(base_renamed_invoices_dir, "Not Renamed") # Skipped files go here
+        self.max_workers = max_workers or default_worker_count() # PDFs read in parallel
+        self.use_cache = use_cache # Reuse results for PDFs already read on an earlier run
+        self.output_strategy = output_strategy # How files get into the output folders, see OUTPUT_STRATEGIES
+        self.collect_timings = collect_timings # Time each stage per file and write a timing report at the end
+        self.metrics_textfile = metrics_textfile # Where the Prometheus textfile goes, default the output folder
+        self.slowest_count = slowest_count # How many of the slowest files the timing report lists
+        self.text_mode = text_mode # "full" matches in whole pages, "header" in the header regions when they're enough
+        self.skip_duplicates = skip_duplicates # Read and copy each distinct PDF once, however many times it was selected
+        self.max_rss_mb = max_rss_mb # Hand out fewer PDFs while the run uses more memory than this
+        self.resume = resume # Carry on from an unfinished run's journal in the output folder, skipping files it finished
+        self.write_workers = write_workers # Files written to the output folders at once, 0 writes them one by one in between reads
+        self.text_backend = text_backend # TEXT_BACKENDS entry that reads the PDFs, "auto" times them all on the first one
+        self.shard_by = tuple(shard_by) # SHARD_LEVELS renamed files are sorted into subfolders by, none keeps them in one folder
+        self.read_timeout = read_timeout # Wall-clock seconds one PDF may take to read before its worker is killed
+        self.read_cpu_seconds = read_cpu_seconds # CPU seconds one PDF may take to read
+        self.read_memory_mb = read_memory_mb # Address space each reading worker may use
+        self.recycle_after = recycle_after # PDFs a reading worker handles before a fresh one replaces it
+        self.single_read = single_read # Read each PDF once, into memory or mapped, to hash, parse and copy it
+
+
+class RenameRun:
+    """One pass of rename_pdfs over a list, or any other iterable, of PDFs.
+
+    All output goes through the log and progress callbacks, so the run can
+    happen on any thread. progress is called with a stage name, the number
+    of files handled and the total, which is None when the PDFs come from a
+    generator. Setting cancel_event stops it between files.
+    """
+
+    def __init__(self, options, log, progress=None, cancel_event=None):
+        self.options = options
+        self.log = log
+        self.progress = progress or (lambda stage, done, total: None)
+        self.cancel_event = cancel_event
+        self.selected_count = 0 # PDFs taken from the input so far, duplicates included
+        self.total = None # How many PDFs were selected, if known up front
+        self.renamed_count = 0
+        self.skipped_count = 0
+        self.duplicate_count = 0
+        self.journal = None # Every file outcome, which the summary file is written from
+        self.checkpoint = None # What the run being resumed had finished
+        self.resumed_count = 0 # Selected PDFs skipped because the run being resumed finished them
+        self.adopted_count = 0 # Outcomes read back from the journal being resumed, included in the counts above
+        self.output_totals = {"strategies": {}, "bytes_written": 0}
+        self.cancelled = False
+        self.failed = False
+        self.queue_depths = QueueDepths()
+        self.timings = StageTimings(options.slowest_count, self.queue_depths) if options.collect_timings else None
+        self.writer = None # Thread pool the output files are written on
+        self.text_backend = None # What options.text_backend turned out to be
+        self.not_renamed_index = None
+        self.shard_indexes = {} # Normalised subfolders -> NameIndex of that folder of renamed files
+        self.read_limits = ReadLimits(
+            options.read_timeout, options.read_cpu_seconds,
+            options.read_memory_mb * 1024 * 1024 if options.read_memory_mb else None, options.recycle_after
+        )
+        self.aborted_count = 0 # PDFs whose reading was stopped for going over read_limits
+
+    @property
+    def handled_count(self):
+        return self.renamed_count + self.skipped_count + self.duplicate_count
+
+    @property
+    def done_count(self):
+        """Selected PDFs dealt with so far, ones the resumed run finished included, as progress counts them."""
+        return self.handled_count - self.adopted_count + self.resumed_count
+
+    def is_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            self.cancelled = True
+        return self.cancelled
+
+    def journal_outcome(self, plan, status, target_path, reason, output, write_seconds):
+        result = plan["result"]
+        invoice_data = result["invoice_data"] or {}
+        if output:
+            strategy_used, bytes_written = output
+            self.output_totals["strategies"][strategy_used] = self.output_totals["strategies"].get(strategy_used, 0) + 1
+            self.output_totals["bytes_written"] += bytes_written
+        record = {
+            "status": status,
+            "source": result["pdf_path"],
+            "target": target_path,
+            "client": invoice_data.get("client_for_naming"),
+            "company_code": invoice_data.get("company_code"),
+            "our_ref_num": invoice_data.get("our_ref_num"),
+            "manifest_num": invoice_data.get("manifest_num"),
+            "reason": reason,
+            "strategy": output[0] if output else None,
+            "bytes_written": output[1] if output else 0,
+            "size": output_size(target_path),
+            "from_cache": bool(result.get("from_cache")),
+            "read_seconds": round(result.get("read_seconds", 0.0), 6),
+            "write_seconds": round(write_seconds, 6),
+            "time": datetime.now().isoformat(timespec="seconds"),
+        }
+        if self.timings is not None:
+            stage_seconds = dict(result.get("stage_seconds") or {})
+            stage_seconds["write"] = stage_seconds.get("write", 0.0) + write_seconds # Plus writing it out of the worker
+            self.timings.add(result["pdf_path"], stage_seconds)
+            record["stages"] = {stage: round(seconds, 6) for stage, seconds in stage_seconds.items()}
+        self.journal.append(record)
+
+    def journal_duplicate(self, pdf_path, original_path):
+        self.journal.append({
+            "status": "duplicate",
+            "source": pdf_path,
+            "target": None,
+            "duplicate_of": original_path,
+            "reason": f"Same content as {os.path.basename(original_path)}.",
+            "time": datetime.now().isoformat(timespec="seconds"),
+        })
+
+    def claim_name(self, index, pdf_path, base_name, ext):
+        """Reserve a name in index, returning it and whether pdf_path is already stored under it.
+
+        When resuming, a file with the same content under one of the names
+        already taken is one the interrupted run wrote but didn't journal,
+        so it is kept instead of being stored again under a _N name.
+        """
+        if self.checkpoint is None:
+            return index.reserve(base_name, ext), False
+        for filename in index.existing(base_name, ext):
+            target_key = os.path.normcase(os.path.join(index.directory, filename))
+            if target_key not in self.checkpoint.targets and same_content(pdf_path, target_key):
+                self.checkpoint.targets.add(target_key)
+                return filename, True
+        filename = index.reserve(base_name, ext)
+        self.checkpoint.targets.add(os.path.normcase(os.path.join(index.directory, filename)))
+        return filename, False
+
+    def calibrate_text_backends(self, pdf_path):
+        """calibrate_text_backends on pdf_path, in a watchdog worker when PDFs are read under limits."""
+        if not self.read_limits.isolate:
+            return calibrate_text_backends(pdf_path, self.options.text_mode)
+        with WatchdogPool(1, self.read_limits) as pool:
+            try:
+                return pool.submit(calibrate_text_backends, pdf_path, self.options.text_mode).result()
+            except Exception as e:
+                self.log(f"Could not time the PDF libraries on {os.path.basename(pdf_path)}: {e}.")
+                return {}
+
+    def shard_index(self, folders):
+        """The NameIndex of the renamed files folder under folders, created and listed the first time it's used.
+
+        Each folder is listed on its own, so a run only lists the folders
+        it writes into and none of them grows past one client's month.
+        """
+        key = tuple(os.path.normcase(folder) for folder in folders)
+        index = self.shard_indexes.get(key)
+        if index is None:
+            directory = os.path.join(self.options.successfully_renamed_dir, *folders)
+            os.makedirs(directory, exist_ok=True)
+            if folders and remove_partial_files(directory):
+                self.log(f"Removed half written files left in {directory} by an interrupted run.")
+            index = self.shard_indexes[key] = NameIndex(directory)
+        return index
+
+    def plan_result(self, result):
+        """Work out where result's file goes and reserve that name, without writing anything."""
+        original_pdf_name = os.path.basename(result["pdf_path"])
+        invoice_data = result["invoice_data"]
+        plan = {
+            "result": result, "renamed_to": None, "skipped_as": None, "reason_skipped": result["reason_skipped"],
+            "already_stored": False,
+        }
+
+        if invoice_data: # If all data was extracted successfully
+            try:
+                new_filename_base = (
+                    f"{invoice_data['client_for_naming']} - "
+                    f"{invoice_data['company_code']} - "
+                    f"{invoice_data['our_ref_num']} - "
+                    f"MANIFEST {invoice_data['manifest_num']}"
+                )
+                safe_filename_base = re.sub(r'[\\/*?:"<>|]', "_", new_filename_base)
+                folders = shard_folders(self.options.shard_by, invoice_data, result["pdf_path"])
+                filename, plan["already_stored"] = self.claim_name(
+                    self.shard_index(folders), result["pdf_path"], safe_filename_base, ".pdf"
+                )
+                plan["renamed_to"] = os.path.join(*folders, filename)
+                return plan
+            except KeyError as e: # Should be less likely if extract_invoice_data_for_rename returns None on failure
+                plan["reason_skipped"] = f"Missing data during filename construction (KeyError: {e})."
+                # Fall through to skip handling
+            except OSError as e:
+                plan["reason_skipped"] = f"Could not create its output folder: {e}."
+                # Fall through to skip handling
+
+        if not plan["reason_skipped"]: # If reason_skipped was not set by a specific error above
+            plan["reason_skipped"] = "Unknown reason for skipping (data extraction might have failed silently)."
+        # Prevent overwriting if a file with the same name was already skipped
+        plan["skipped_as"], plan["already_stored"] = self.claim_name(
+            self.not_renamed_index, result["pdf_path"], *os.path.splitext(original_pdf_name)
+        )
+        return plan
+
+    def start_store(self, plan):
+        """Start writing plan's file to its output folder.
+
+        Returns a Future for store_file's outcome when writing on the writer
+        threads, or the outcome itself.
+        """
+        staged_path = plan["result"].get("staged_path")
+        if plan["already_stored"]:
+            if staged_path is not None:
+                remove_file(staged_path)
+            return None, 0.0, None
+        if plan["renamed_to"]:
+            target_path = os.path.join(self.options.successfully_renamed_dir, plan["renamed_to"])
+        else:
+            target_path = os.path.join(self.options.not_renamed_dir, plan["skipped_as"])
+        args = (plan["result"]["pdf_path"], target_path, self.options.output_strategy, staged_path)
+        if self.writer is None:
+            return store_file(*args)
+        return self.writer.submit(store_file, *args)
+
+    def finish_store(self, plan, outcome):
+        """Log and journal plan's file once start_store's write is done."""
+        result = plan["result"]
+        pdf_path = result["pdf_path"]
+        original_pdf_name = os.path.basename(pdf_path)
+        reason_skipped = plan["reason_skipped"]
+        skipped_as = plan["skipped_as"]
+        already_stored = plan["already_stored"]
+        output, write_seconds, error = outcome
+
+        self.log(f"\nProcessing: {original_pdf_name}...")
+        for line in result["logs"]:
+            self.log(line)
+
+        if plan["renamed_to"]:
+            client_name_for_file = result["invoice_data"]["client_for_naming"]
+            new_filename_with_ext = plan["renamed_to"]
+            target_path = os.path.join(self.options.successfully_renamed_dir, new_filename_with_ext)
+            if error is None:
+                if already_stored:
+                    self.log(f"Already renamed before the interruption (Client: {client_name_for_file}): {original_pdf_name} -> {new_filename_with_ext}")
+                else:
+                    self.log(f"Successfully renamed (Client: {client_name_for_file}): {original_pdf_name} -> {new_filename_with_ext}")
+                self.renamed_count += 1
+                self.journal_outcome(plan, "renamed", target_path, None, output, write_seconds)
+                return
+            reason_skipped = f"Unexpected error during renaming: {error}."
+            skipped_as, already_stored = self.claim_name(
+                self.not_renamed_index, pdf_path, *os.path.splitext(original_pdf_name)
+            )
+            output, write_seconds, error = (None, 0.0, None) if already_stored else store_file(
+                pdf_path, os.path.join(self.options.not_renamed_dir, skipped_as), self.options.output_strategy
+            )
+            # Fall through to skip handling
+
+        self.skipped_count += 1
+        target_path = os.path.join(self.options.not_renamed_dir, skipped_as)
+        if error is not None:
+            target_path = None
+            self.log(f"Error copying {original_pdf_name} to 'Not Renamed' folder: {error}")
+        elif already_stored:
+            self.log(f"Already in 'Not Renamed' folder from before the interruption: {original_pdf_name} (as {skipped_as})")
+        else:
+            self.log(f"Copied to 'Not Renamed' folder: {original_pdf_name} (as {skipped_as})")
+        self.journal_outcome(plan, "skipped", target_path, reason_skipped, output, write_seconds)
+
+    def finish_stores(self, writes, keep):
+        """Finish the writes at the front of writes, in order, until at most keep are left.
+
+        Writes that are already done are finished as well, so the journal
+        and the progress bar keep up with the writer threads.
+        """
+        while writes and (len(writes) > keep or not isinstance(writes[0][1], Future) or writes[0][1].done()):
+            plan, outcome = writes.popleft()
+            if isinstance(outcome, Future):
+                outcome = outcome.result()
+            self.finish_store(plan, outcome)
+            self.progress("Processed", self.done_count, self.total)
+
+    def iter_unique_pdfs(self, pdf_paths, digests):
+        """Yield pdf_paths, leaving out the ones the resumed run finished and
+        journaling and leaving out copies of a PDF already seen.
+
+        The digest of each file yielded is put in digests under its position
+        among the files yielded, when it had to be hashed.
+        """
+        # A moved file is gone from its folder by the time a copy of it can turn up
+        finder = DuplicateFinder(hash_first=self.options.output_strategy == "move") if self.options.skip_duplicates else None
+        unique_count = 0
+        for pdf_path in pdf_paths:
+            self.selected_count += 1
+            if self.checkpoint is not None and self.checkpoint.take(pdf_path):
+                if finder is not None:
+                    finder.check(pdf_path) # So copies of it later on are still spotted
+                self.resumed_count += 1
+                self.progress("Processed", self.done_count, self.total)
+                continue
+            if finder is not None:
+                original_path, digest = finder.check(pdf_path)
+                if original_path is not None:
+                    self.log(f"\nDuplicate: {os.path.basename(pdf_path)} (same as {os.path.basename(original_path)})")
+                    self.journal_duplicate(pdf_path, original_path)
+                    self.duplicate_count += 1
+                    self.progress("Processed", self.done_count, self.total)
+                    continue
+                if digest is not None:
+                    digests[unique_count] = digest
+            unique_count += 1
+            yield pdf_path
+
+    def run(self, pdf_files_to_rename):
+        options = self.options
+        self.total = len(pdf_files_to_rename) if hasattr(pdf_files_to_rename, "__len__") else None
+        pdf_paths = iter(pdf_files_to_rename)
+        first_path = next(pdf_paths, None)
+        if first_path is None:
+            self.log("No PDF files selected to rename.")
+            return
+        pdf_paths = itertools.chain([first_path], pdf_paths)
+
+        # Ensure base and subdirectories exist
+        try:
+            os.makedirs(options.successfully_renamed_dir, exist_ok=True) # For successfully renamed files
+            os.makedirs(options.not_renamed_dir, exist_ok=True)      # For files that couldn't be renamed
+            self.log(f"Ensured output directory exists: {options.base_renamed_invoices_dir}")
+            self.log(f"Skipped files will be copied to: {options.not_renamed_dir}")
+            if options.shard_by:
+                self.log(f"Renamed files are sorted into {'/'.join(options.shard_by)} folders.")
+        except OSError as e:
+            self.log(f"Error creating output directories: {e}")
+            self.failed = True
+            return
+
+        try:
+            for directory in (options.successfully_renamed_dir, options.not_renamed_dir):
+                if remove_partial_files(directory):
+                    self.log(f"Removed half written files left in {directory} by an interrupted run.")
+            journal_path = latest_journal(options.base_renamed_invoices_dir) if options.resume else None
+            if journal_path is not None and run_finished(journal_path):
+                self.log(f"The latest run finished, so there is nothing to resume: {journal_path}")
+                self.log("Starting a new run.")
+                journal_path = None
+            elif journal_path is not None:
+                self.resume_from(Checkpoint(journal_path))
+            elif options.resume:
+                self.log("No earlier run to resume, starting from the beginning.")
+            if journal_path is None:
+                journal_path = timestamped_path(options.base_renamed_invoices_dir, JOURNAL_PREFIX, ".jsonl")
+            self.journal = RunJournal(journal_path)
+        except (OSError, ValueError) as e:
+            self.log(f"Error creating run journal: {e}")
+            self.failed = True
+            return
+        if self.checkpoint is not None:
+            self.journal.append({
+                "status": "run resumed",
+                "finished": len(self.checkpoint.records),
+                "redo": self.checkpoint.redo_count,
+                "time": datetime.now().isoformat(timespec="seconds"),
+            })
+        self.log(f"Writing run journal to: {journal_path}")
+        if self.read_limits.isolate:
+            self.log(f"Each PDF is read in a worker process and stopped after {self.read_limits.describe()}.")
+        # Copies are written from the buffer each PDF was read into, straight
+        # into the output folder, which every output subfolder shares a
+        # filesystem with; other strategies don't read the file to store it
+        stage_dir = options.base_renamed_invoices_dir if options.single_read and options.output_strategy == "copy" else None
+        if options.single_read:
+            self.log("Reading each PDF once, for hashing, its text" + (" and its copy." if stage_dir else "."))
+
+        self.text_backend = options.text_backend
+        if self.text_backend == "auto":
+            seconds = self.calibrate_text_backends(first_path)
+            self.text_backend = min(seconds, key=seconds.get) if seconds else DEFAULT_TEXT_BACKEND
+            timings = ", ".join(f"{name} {elapsed * 1000:.1f} ms" for name, elapsed in sorted(seconds.items(), key=lambda item: item[1]))
+            self.log(f"Reading PDFs with {self.text_backend} ({timings or 'no backend could read'} on {os.path.basename(first_path)}).")
+
+        cache = None
+        if options.use_cache:
+            try:
+                cache = ExtractionCache(
+                    os.path.join(options.base_renamed_invoices_dir, CACHE_FILENAME),
+                    rules_version=extraction_version(options.text_mode)
+                )
+            except Exception as e:
+                self.log(f"Extraction cache unavailable, reading every PDF: {e}")
+
+        # PDFs are read in parallel a few at a time, and every result is named
+        # in selection order as soon as the ones before it are done, so
+        # collision suffixes match a serial run. Its file is then written on
+        # the writer threads while later PDFs are read, and logged and
+        # journaled in selection order once written, so the summary matches
+        # too and nothing is kept per file except the journal line on disk.
+        # Copies of a PDF already seen are left out before they are read.
+        self.not_renamed_index = NameIndex(options.not_renamed_dir)
+        cached_count = 0
+        header_only_count = 0
+        digests = {}
+        self.progress("Processed", self.done_count, self.total)
+        processed = iter_processed_pdfs(
+            self.iter_unique_pdfs(pdf_paths, digests), options.max_workers, cache, options.collect_timings,
+            options.text_mode, digests, options.max_rss_mb * 1024 * 1024 if options.max_rss_mb else None, self.log,
+            self.queue_depths, self.text_backend, self.read_limits, options.single_read, stage_dir
+        )
+        writes = deque() # (plan, Future or outcome), in selection order
+        write_ahead = options.write_workers * WRITE_AHEAD_PER_WRITER
+        if options.write_workers > 0:
+            self.writer = ThreadPoolExecutor(max_workers=options.write_workers, thread_name_prefix="doby-writer")
+        try:
+            for index, result in processed:
+                if result.get("from_cache"):
+                    cached_count += 1
+                if result.get("text_source") == "header":
+                    header_only_count += 1
+                if result.get("read_aborted"):
+                    self.aborted_count += 1
+                plan = self.plan_result(result)
+                writes.append((plan, self.start_store(plan)))
+                self.finish_stores(writes, write_ahead)
+                if self.writer is not None:
+                    self.queue_depths.sample("write", (outcome for _, outcome in writes), write_ahead)
+                if self.is_cancelled():
+                    break
+            self.finish_stores(writes, 0) # Files already being written are kept, even when cancelled
+            self.journal.append({
+                "status": "run finished",
+                "renamed": self.renamed_count,
+                "skipped": self.skipped_count,
+                "duplicates": self.duplicate_count,
+                "resumed": self.resumed_count,
+                "aborted": self.aborted_count,
+                "cancelled": self.cancelled,
+                "output": self.output_totals,
+                "queues": self.queue_depths.summary(),
+                "text_backend": self.text_backend,
+                "shard_by": list(options.shard_by),
+                "shards": len(self.shard_indexes),
+                "time": datetime.now().isoformat(timespec="seconds"),
+            })
+        finally:
+            processed.close() # Drops any PDFs still queued for the workers
+            if self.writer is not None:
+                self.writer.shutdown(wait=True, cancel_futures=True)
+                self.writer = None
+            if stage_dir is not None:
+                remove_partial_files(stage_dir) # Copies of PDFs read but never stored, e.g. after cancelling
+            if cache is not None:
+                cache.close()
+            self.journal.close()
+
+        if self.cancelled:
+            of_total = f" of {self.total}" if self.total is not None else ""
+            self.log(f"\n--- Renaming Cancelled after {self.done_count}{of_total} file(s) ---")
+        else:
+            self.log(f"\n--- Renaming Complete ---")
+        if self.checkpoint is not None:
+            self.log(f"Already done before the interruption: {self.resumed_count} file(s).")
+        self.log(f"Successfully renamed: {self.renamed_count} file(s).")
+        self.log(f"Skipped (and copied to 'Not Renamed' folder): {self.skipped_count} file(s).")
+        if self.duplicate_count:
+            self.log(f"Duplicates (not read or copied): {self.duplicate_count} file(s).")
+        if self.aborted_count:
+            self.log(f"Stopped reading {self.aborted_count} file(s) that went over {self.read_limits.describe()}, "
+                     "they are in the 'Not Renamed' folder.")
+        self.log(f"Output ({options.output_strategy}): {format_output_totals(self.output_totals)}.")
+        if cache is not None:
+            self.log(f"Reused earlier results for {cached_count} unchanged file(s).")
+        if options.text_mode == "header":
+            self.log(f"Header regions were enough for {header_only_count} file(s), the rest were read in full.")
+        if self.queue_depths.queues:
+            self.log(f"Queue depths: {self.queue_depths.describe()}.")
+
+        self.write_summary()
+        if self.timings is not None:
+            self.write_timings()
+
+    def resume_from(self, checkpoint):
+        """Start from where the run that wrote checkpoint's journal stopped."""
+        self.log(f"Resuming the run in: {checkpoint.journal_path}")
+        checkpoint.rewrite_journal()
+        for record in checkpoint.records:
+            if record["status"] == "renamed":
+                self.renamed_count += 1
+            elif record["status"] == "skipped":
+                self.skipped_count += 1
+            else:
+                self.duplicate_count += 1
+            if record.get("strategy"):
+                strategies = self.output_totals["strategies"]
+                strategies[record["strategy"]] = strategies.get(record["strategy"], 0) + 1
+                self.output_totals["bytes_written"] += record.get("bytes_written", 0)
+        self.adopted_count = len(checkpoint.records)
+        self.log(f"{len(checkpoint.records)} file(s) were finished before.")
+        if checkpoint.redo_count:
+            self.log(f"{checkpoint.redo_count} file(s) were not stored completely and will be done again if selected.")
+        self.checkpoint = checkpoint
+
+    def write_summary(self):
+        # Generate summary file with improved formatting, from the run journal
+        if self.renamed_count or self.skipped_count or self.duplicate_count:
+            summary_filepath = timestamped_path( # Summary in the base "Renamed Invoices"
+                self.options.base_renamed_invoices_dir, "_Renaming_Summary_AutoDetected_", ".txt"
+            )
+            try:
+                with open(summary_filepath, "w") as f:
+                    f.write("======================================================================\n")
+                    f.write("          PDF Invoice Renaming Summary - Client Auto-Detection\n")
+                    f.write(f"                          Run on: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+                    f.write("======================================================================\n\n")
+                    f.write(f"Output ({self.options.output_strategy}): {format_output_totals(self.output_totals)}\n\n")
+                    if self.checkpoint is not None:
+                        f.write(f"Resumed an interrupted run; {len(self.checkpoint.records)} file(s) were finished before.\n\n")
+                    if self.cancelled:
+                        f.write("This run was cancelled before every selected file was processed.\n\n")
+
+                    if self.skipped_count:
+                        f.write("----------------------------------------------------------------------\n")
+                        f.write(f"FILES THAT COULD NOT BE RENAMED ({self.skipped_count}):\n")
+                        f.write("(These files have been copied to the 'Not Renamed' subfolder)\n")
+                        f.write("----------------------------------------------------------------------\n")
+                        for record in read_journal(self.journal.path, ("skipped",)):
+                            f.write(f"  Original: {os.path.basename(record['source'])}\n  Reason: {record['reason']}\n" + "\n")
+                        f.write("\n")
+                    else:
+                        f.write("----------------------------------------------------------------------\n")
+                        f.write("All processed files were successfully renamed.\n")
+                        f.write("----------------------------------------------------------------------\n\n")
+
+
+                    if self.renamed_count:
+                        f.write("----------------------------------------------------------------------\n")
+                        f.write(f"FILES SUCCESSFULLY RENAMED ({self.renamed_count}):\n")
+                        f.write("----------------------------------------------------------------------\n")
+                        for record in read_journal(self.journal.path, ("renamed",)):
+                            f.write(
+                                f"  Original: {os.path.basename(record['source'])}\n"
+                                f"  Renamed To: {os.path.relpath(record['target'], self.options.successfully_renamed_dir)}\n"
+                                f"  Detected Client: {record['client']}\n" + "\n"
+                            )
+                    else:
+                        f.write("----------------------------------------------------------------------\n")
+                        f.write("No files were successfully renamed in this run.\n")
+                        f.write("----------------------------------------------------------------------\n\n")
+
+                    if self.duplicate_count:
+                        f.write("----------------------------------------------------------------------\n")
+                        f.write(f"DUPLICATE FILES ({self.duplicate_count}):\n")
+                        f.write("(Same content as another selected file, so they were not copied)\n")
+                        f.write("----------------------------------------------------------------------\n")
+                        for record in read_journal(self.journal.path, ("duplicate",)):
+                            f.write(
+                                f"  Original: {os.path.basename(record['source'])}\n"
+                                f"  Same As: {os.path.basename(record['duplicate_of'])}\n" + "\n"
+                            )
+
+                    f.write("======================================================================\n")
+                    f.write("End of Summary\n")
+                    f.write("======================================================================\n")
+
+                self.log(f"Renaming summary saved to: {summary_filepath}")
+            except Exception as e:
+                self.log(f"Error writing summary file: {e}")
+
+
+    def write_timings(self):
+        timings = self.timings
+        stage_totals = ", ".join(
+            f"{stage} {summary['sum']:.2f}s" for stage, summary in timings.stages.items() if summary["count"]
+        )
+        self.log(f"Time per stage: {stage_totals or 'nothing timed'}.")
+        slowest_files = timings.slowest_files()
+        if slowest_files:
+            self.log(f"Slowest {len(slowest_files)} file(s):")
+            for entry in slowest_files:
+                breakdown = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in entry["stages"].items())
+                self.log(f"  {os.path.basename(entry['source'])}: {entry['total_seconds']:.3f}s ({breakdown})")
+
+        report_path = timestamped_path(self.options.base_renamed_invoices_dir, "_Renaming_Timings_", ".json")
+        metrics_path = self.options.metrics_textfile or os.path.join(self.options.base_renamed_invoices_dir, "doby_rename.prom")
+        try:
+            timings.write_json(report_path)
+            self.log(f"Timing report saved to: {report_path}")
+            timings.write_prometheus(metrics_path, {"renamed": self.renamed_count, "skipped": self.skipped_count})
+            self.log(f"Prometheus metrics saved to: {metrics_path}")
+        except Exception as e:
+            self.log(f"Error writing timing report: {e}")
+
+
+def rename_pdfs(pdf_files_to_rename, options, log, progress=None, cancel_event=None):
+    """Rename pdf_files_to_rename into options.base_renamed_invoices_dir and write the summary.
+
+    Returns the finished RenameRun, which holds the counts.
+    """
+    run = RenameRun(options, log, progress, cancel_event)
+    run.run(pdf_files_to_rename)
+    return run
+
+
+# Exit codes for the command line
+EXIT_OK = 0           # Every PDF was renamed
+EXIT_SKIPPED = 1      # Some PDFs went to "Not Renamed"
+EXIT_USAGE = 2        # Bad arguments or no PDFs to work on
+EXIT_FAILED = 3       # The output folders could not be created
+EXIT_CANCELLED = 130  # Interrupted with Ctrl+C
+
+
+def iter_pdf_paths(input_paths):
+    """PDFs named directly plus the PDFs inside any folders, like Select Folder does.
+
+    Folders are listed one at a time as the paths are consumed, so a huge
+    folder never has to be held as a list of full paths.
+    """
+    for input_path in input_paths:
+        if os.path.isdir(input_path):
+            for filename in sorted(os.listdir(input_path)):
+                if filename.lower().endswith(".pdf"):
+                    yield os.path.join(input_path, filename)
+        elif os.path.isfile(input_path):
+            yield input_path
+        else:
+            raise FileNotFoundError(f"No such file or folder: {input_path}")
+
+
+def add_run_arguments(parser):
+    """Add the options of a rename run that the command line and the window share to parser.
+
+    options_from_args checks them once they are parsed.
+    """
+    parser.add_argument("--output-strategy", choices=OUTPUT_STRATEGIES, default="copy",
+                        help="how files get into the output folders; falls back to copying when the filesystem can't")
+    parser.add_argument("--write-workers", type=int, default=DEFAULT_WRITE_WORKERS, metavar="N",
+                        help=f"files written to the output folders at once while later PDFs are read (default: {DEFAULT_WRITE_WORKERS}, "
+                             "0 writes each one before reading on)")
+    parser.add_argument("--shard-by", default="", metavar="LEVELS",
+                        help=f"sort renamed files into subfolders by these comma separated levels, from {', '.join(SHARD_LEVELS)} "
+                             "(default: one folder), e.g. client,company,month")
+    parser.add_argument("--no-cache", action="store_true", help="read every PDF again instead of reusing earlier results")
+    parser.add_argument("--rules", metavar="PATH",
+                        help=f"sender and client rules file (default: ${RULES_PATH_ENV} or {DEFAULT_RULES_PATH})")
+    parser.add_argument("--text-mode", choices=TEXT_MODES, default="full",
+                        help="'header' matches fields in the invoice header regions first, and in whole pages only for fields "
+                             "missing there; it narrows where fields are looked for and isn't faster")
+    parser.add_argument("--text-backend", choices=TEXT_BACKEND_CHOICES, default=DEFAULT_TEXT_BACKEND,
+                        help=f"PDF library that reads the text (default: {DEFAULT_TEXT_BACKEND}); 'auto' times every installed one "
+                             "on the first PDF, even when the cache has it, and picks the fastest that agrees with pdfium")
+    parser.add_argument("--keep-duplicates", action="store_true",
+                        help="read and copy every selected PDF, even ones with the same content as another")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on from the last run in the output folder if it was interrupted or cancelled, skipping the files it finished")
+    parser.add_argument("--single-read", action="store_true",
+                        help=f"read each PDF once and hash, parse and copy it from memory; files of {format_bytes(MMAP_THRESHOLD)} "
+                             "or more are mapped instead")
+    parser.add_argument("--max-rss", type=int, metavar="MB",
+                        help="read fewer PDFs at once while the run uses more than this much memory")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT, metavar="SECONDS",
+                        help=f"stop reading a PDF that takes longer than this and skip it (default: {DEFAULT_READ_TIMEOUT}, 0 for no limit)")
+    parser.add_argument("--read-cpu", type=float, default=DEFAULT_READ_CPU_SECONDS, metavar="SECONDS",
+                        help=f"stop reading a PDF that uses more CPU time than this (default: {DEFAULT_READ_CPU_SECONDS}, 0 for no limit)")
+    parser.add_argument("--read-memory", type=int, metavar="MB",
+                        help="stop reading a PDF whose worker needs more memory than this")
+    parser.add_argument("--recycle-after", type=int, default=DEFAULT_RECYCLE_AFTER, metavar="N",
+                        help=f"replace each reading worker after N PDFs (default: {DEFAULT_RECYCLE_AFTER}, 0 never)")
+    parser.add_argument("--timings", action="store_true",
+                        help="time each stage per file and write a JSON timing report and a Prometheus textfile")
+
+
+def options_from_args(parser, args):
+    """Check the options add_run_arguments added and return them as RenameOptions keyword arguments.
+
+    Loads the --rules file. Bad options end the program through parser.error.
+    """
+    if args.write_workers < 0:
+        parser.error("--write-workers can't be negative")
+    try:
+        shard_by = parse_shard_levels(args.shard_by)
+    except ValueError as e:
+        parser.error(f"--shard-by: {e}")
+    if args.rules:
+        try:
+            use_rules(args.rules)
+        except (OSError, ValueError, re.error) as e:
+            parser.error(f"could not load rules from {args.rules}: {e}")
+    if args.max_rss is not None and args.max_rss <= 0:
+        parser.error("--max-rss must be more than 0")
+    if args.read_timeout < 0 or args.read_cpu < 0 or args.recycle_after < 0:
+        parser.error("--read-timeout, --read-cpu and --recycle-after can't be negative")
+    if args.read_memory is not None and args.read_memory <= 0:
+        parser.error("--read-memory must be more than 0")
+    if args.text_backend != "auto" and not TEXT_BACKENDS[args.text_backend].available():
+        parser.error(f"--text-backend {args.text_backend} needs {TEXT_BACKENDS[args.text_backend].module_names[0]}, which isn't installed")
+    return {
+        "use_cache": not args.no_cache,
+        "output_strategy": args.output_strategy,
+        "collect_timings": args.timings,
+        "text_mode": args.text_mode,
+        "skip_duplicates": not args.keep_duplicates,
+        "max_rss_mb": args.max_rss,
+        "resume": args.resume,
+        "write_workers": args.write_workers,
+        "text_backend": args.text_backend,
+        "shard_by": shard_by,
+        "read_timeout": args.read_timeout,
+        "read_cpu_seconds": args.read_cpu,
+        "read_memory_mb": args.read_memory,
+        "recycle_after": args.recycle_after,
+        "single_read": args.single_read,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m doby_core",
+        description="Rename PDF invoices by client, company, ref num and manifest without opening the window."
+    )
+    parser.add_argument("inputs", nargs="+", help="PDF files, or folders whose PDFs should be renamed")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT_DIR,
+                        help=f"folder for renamed files and the summary (default: {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument("-j", "--workers", type=int, default=default_worker_count(),
+                        help="number of worker processes reading PDFs (default: one per CPU)")
+    add_run_arguments(parser)
+    parser.add_argument("--metrics-textfile", metavar="PATH",
+                        help="where --timings writes the Prometheus textfile (default: doby_rename.prom in the output folder)")
+    parser.add_argument("--slowest", type=int, default=10, metavar="N",
+                        help="how many of the slowest files --timings lists (default: 10)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print the final counts")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.slowest < 0:
+        parser.error("--slowest can't be negative")
+    run_options = options_from_args(parser, args)
+    for input_path in args.inputs:
+        if not os.path.exists(input_path):
+            parser.error(f"No such file or folder: {input_path}")
+    pdf_paths = iter_pdf_paths(args.inputs)
+    first_path = next(pdf_paths, None)
+    if first_path is None:
+        print("No PDF files found to rename.", file=sys.stderr)
+        return EXIT_USAGE
+    pdf_paths = itertools.chain([first_path], pdf_paths)
+
+    if args.metrics_textfile:
+        run_options["collect_timings"] = True
+    options = RenameOptions(
+        args.output,
+        max_workers=args.workers,
+        metrics_textfile=args.metrics_textfile,
+        slowest_count=args.slowest,
+        **run_options
+    )
+    log = (lambda message: None) if args.quiet else print
+    try:
+        run = rename_pdfs(pdf_paths, options, log)
+    except KeyboardInterrupt:
+        print("Cancelled.", file=sys.stderr)
+        return EXIT_CANCELLED
+
+    if run.failed:
+        return EXIT_FAILED
+    if args.quiet:
+        duplicates = f", {run.duplicate_count} duplicate(s)" if run.duplicate_count else ""
+        print(f"Renamed {run.renamed_count}, skipped {run.skipped_count}{duplicates} of {run.selected_count} PDF(s).")
+    return EXIT_SKIPPED if run.skipped_count else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""The DobY window, PDFRenamerApp.
+
+Kept out of dobyv2.0.4.py, which only imports it when run as the program:
+worker processes are spawned and import the main script again, and they
+shouldn't load tkinter and customtkinter with it.
+"""
+import queue
+import threading
+import tkinter
+import customtkinter
+from tkinter import filedialog
+import os
+from doby_core import (
+    DEFAULT_OUTPUT_DIR, DEFAULT_READ_CPU_SECONDS, DEFAULT_READ_TIMEOUT, DEFAULT_RECYCLE_AFTER, DEFAULT_TEXT_BACKEND,
+    DEFAULT_WRITE_WORKERS, OUTPUT_STRATEGIES, RenameOptions, default_worker_count, rename_pdfs
+)
+
+EVENT_POLL_INTERVAL_MS = 100 # How often the window picks up log lines from the worker thread
+MAX_EVENTS_PER_POLL = 2000   # Keeps one poll from hogging the Tk thread on a burst
+MAX_LOG_LINES = 5000         # Older lines are dropped from the textbox, the summary file has everything
+
+class PDFRenamerApp(customtkinter.CTk):
+    def __init__(self, use_cache=True, output_strategy="copy", collect_timings=False, text_mode="full",
+                 skip_duplicates=True, max_rss_mb=None, resume=False, write_workers=DEFAULT_WRITE_WORKERS,
+                 text_backend=DEFAULT_TEXT_BACKEND, shard_by=(), read_timeout=DEFAULT_READ_TIMEOUT,
+                 read_cpu_seconds=DEFAULT_READ_CPU_SECONDS, read_memory_mb=None, recycle_after=DEFAULT_RECYCLE_AFTER,
+                 single_read=False):
+        super().__init__()
+
+        self.title("PDF Invoice Renamer")
+        self.geometry("700x600") # Adjusted height as dropdown is removed
+
+        customtkinter.set_appearance_mode("dark")
+        customtkinter.set_default_color_theme("blue")
+
+        self.pdf_files_to_rename = []
+        self.base_renamed_invoices_dir = DEFAULT_OUTPUT_DIR # Base directory for all output
+        self.max_workers = default_worker_count() # PDFs read in parallel
+        self.use_cache = use_cache # Reuse results for PDFs already read on an earlier run
+        self.output_strategy = output_strategy # How files get into the output folders, see OUTPUT_STRATEGIES
+        self.collect_timings = collect_timings # Write a per-stage timing report after each run
+        self.text_mode = text_mode # "header" matches in the invoice header regions when they're enough
+        self.skip_duplicates = skip_duplicates # Read and copy each distinct PDF once
+        self.max_rss_mb = max_rss_mb # Read fewer PDFs at once while the run uses more memory than this
+        self.resume = resume # Carry on from an unfinished last run in the output folder, skipping the files it finished
+        self.write_workers = write_workers # Files written to the output folders at once while later PDFs are read
+        self.text_backend = text_backend # PDF library that reads the text, "auto" times them all on the first PDF
+        self.shard_by = shard_by # Subfolders renamed files are sorted into, e.g. ("client", "month")
+        self.read_timeout = read_timeout # Seconds one PDF may take to read before it is skipped
+        self.read_cpu_seconds = read_cpu_seconds # CPU seconds one PDF may take to read
+        self.read_memory_mb = read_memory_mb # Memory each worker reading PDFs may use
+        self.recycle_after = recycle_after # PDFs each reading worker handles before it is replaced
+        self.single_read = single_read # Read each PDF once over the network, then hash, parse and copy it from memory
+        self.events = queue.Queue() # Log and progress events from the renaming thread
+        self.rename_thread = None
+        self.cancel_event = None
+
+        # --- UI Elements ---
+        self.main_frame = customtkinter.CTkFrame(self)
+        self.main_frame.pack(pady=20, padx=20, fill="both", expand=True)
+
+        self.select_folder_button = customtkinter.CTkButton(self.main_frame, text="Select Folder with Invoices", command=self.select_folder)
+        self.select_folder_button.pack(pady=10)
+
+        self.select_files_button = customtkinter.CTkButton(self.main_frame, text="Select Invoice Files", command=self.select_files)
+        self.select_files_button.pack(pady=10)
+
+        self.files_found_label = customtkinter.CTkLabel(self.main_frame, text="PDFs selected: 0")
+        self.files_found_label.pack(pady=10)
+
+        self.workers_frame = customtkinter.CTkFrame(self.main_frame, fg_color="transparent")
+        self.workers_frame.pack(pady=5)
+        self.workers_label = customtkinter.CTkLabel(self.workers_frame, text="Worker processes:")
+        self.workers_label.pack(side="left", padx=5)
+        self.workers_menu = customtkinter.CTkOptionMenu(
+            self.workers_frame,
+            values=[str(n) for n in range(1, default_worker_count() + 1)],
+            command=self.set_max_workers
+        )
+        self.workers_menu.set(str(self.max_workers))
+        self.workers_menu.pack(side="left", padx=5)
+
+        self.output_frame = customtkinter.CTkFrame(self.main_frame, fg_color="transparent")
+        self.output_frame.pack(pady=5)
+        self.output_label = customtkinter.CTkLabel(self.output_frame, text="Output files by:")
+        self.output_label.pack(side="left", padx=5)
+        self.output_menu = customtkinter.CTkOptionMenu(
+            self.output_frame, values=list(OUTPUT_STRATEGIES), command=self.set_output_strategy
+        )
+        self.output_menu.set(self.output_strategy)
+        self.output_menu.pack(side="left", padx=5)
+
+        self.use_cache_var = customtkinter.BooleanVar(value=self.use_cache)
+        self.use_cache_checkbox = customtkinter.CTkCheckBox(
+            self.main_frame, text="Reuse results from earlier runs", variable=self.use_cache_var, command=self.set_use_cache
+        )
+        self.use_cache_checkbox.pack(pady=5)
+
+        self.run_frame = customtkinter.CTkFrame(self.main_frame, fg_color="transparent")
+        self.run_frame.pack(pady=20)
+        self.rename_button = customtkinter.CTkButton(self.run_frame, text="Rename Selected PDFs", command=self.rename_pdfs, state="disabled")
+        self.rename_button.pack(side="left", padx=5)
+        self.cancel_button = customtkinter.CTkButton(self.run_frame, text="Cancel", command=self.cancel_rename, state="disabled")
+        self.cancel_button.pack(side="left", padx=5)
+
+        self.progress_bar = customtkinter.CTkProgressBar(self.main_frame)
+        self.progress_bar.set(0)
+        self.progress_bar.pack(pady=5, padx=10, fill="x")
+
+        self.log_textbox = customtkinter.CTkTextbox(self.main_frame, height=300, state="disabled") # Increased height
+        self.log_textbox.pack(pady=10, padx=10, fill="both", expand=True)
+
+    def log_message(self, message):
+        self.append_log_lines([message])
+
+    def append_log_lines(self, lines):
+        self.log_textbox.configure(state="normal")
+        self.log_textbox.insert(tkinter.END, "\n".join(lines) + "\n")
+        line_count = int(self.log_textbox.index("end-1c").split(".")[0])
+        if line_count > MAX_LOG_LINES:
+            self.log_textbox.delete("1.0", f"{line_count - MAX_LOG_LINES + 1}.0")
+        self.log_textbox.see(tkinter.END)
+        self.log_textbox.configure(state="disabled")
+
+    def select_folder(self):
+        folder_path = filedialog.askdirectory(title="Select Folder Containing PDF Invoices")
+        if folder_path:
+            self.pdf_files_to_rename = []
+            for filename in os.listdir(folder_path):
+                if filename.lower().endswith(".pdf"):
+                    self.pdf_files_to_rename.append(os.path.join(folder_path, filename))
+            self.update_files_found_label()
+            self.log_message(f"Selected folder: {folder_path}")
+            self.log_message(f"Found {len(self.pdf_files_to_rename)} PDF files.")
+
+    def select_files(self):
+        file_paths = filedialog.askopenfilenames(
+            title="Select PDF Invoice Files",
+            filetypes=(("PDF files", "*.pdf"), ("All files", "*.*"))
+        )
+        if file_paths:
+            self.pdf_files_to_rename = list(file_paths)
+            self.update_files_found_label()
+            self.log_message(f"Selected {len(self.pdf_files_to_rename)} PDF files.")
+
+    def update_files_found_label(self):
+        count = len(self.pdf_files_to_rename)
+        self.files_found_label.configure(text=f"PDFs selected: {count}")
+        if count > 0:
+            self.rename_button.configure(state="normal")
+        else:
+            self.rename_button.configure(state="disabled")
+
+    def set_max_workers(self, value):
+        self.max_workers = int(value)
+
+    def set_output_strategy(self, value):
+        self.output_strategy = value
+
+    def set_use_cache(self):
+        self.use_cache = self.use_cache_var.get()
+
+    def rename_pdfs(self):
+        if not self.pdf_files_to_rename:
+            self.log_message("No PDF files selected to rename.")
+            return
+        if self.rename_thread is not None and self.rename_thread.is_alive():
+            return
+
+        options = RenameOptions(
+            self.base_renamed_invoices_dir,
+            max_workers=self.max_workers,
+            use_cache=self.use_cache,
+            output_strategy=self.output_strategy,
+            collect_timings=self.collect_timings,
+            text_mode=self.text_mode,
+            skip_duplicates=self.skip_duplicates,
+            max_rss_mb=self.max_rss_mb,
+            resume=self.resume,
+            write_workers=self.write_workers,
+            text_backend=self.text_backend,
+            shard_by=self.shard_by,
+            read_timeout=self.read_timeout,
+            read_cpu_seconds=self.read_cpu_seconds,
+            read_memory_mb=self.read_memory_mb,
+            recycle_after=self.recycle_after,
+            single_read=self.single_read
+        )
+        self.cancel_event = threading.Event()
+        self.set_controls_running(True)
+        self.progress_bar.set(0)
+        self.rename_thread = threading.Thread(
+            target=self.rename_in_background, args=(list(self.pdf_files_to_rename), options), daemon=True
+        )
+        self.rename_thread.start()
+        self.after(EVENT_POLL_INTERVAL_MS, self.drain_events)
+
+    def rename_in_background(self, pdf_files, options):
+        # Runs on the worker thread: never touch widgets here, only the queue
+        try:
+            rename_pdfs(
+                pdf_files,
+                options,
+                log=lambda message: self.events.put(("log", message)),
+                progress=lambda stage, done, total: self.events.put(("progress", stage, done, total)),
+                cancel_event=self.cancel_event
+            )
+        except Exception as e:
+            self.events.put(("log", f"Renaming stopped by an unexpected error: {e}"))
+        finally:
+            self.events.put(("done",))
+
+    def drain_events(self):
+        lines = []
+        progress = None
+        done = False
+        for _ in range(MAX_EVENTS_PER_POLL):
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "log":
+                lines.append(event[1])
+            elif event[0] == "progress":
+                progress = event[1:]
+            else:
+                done = True
+        if lines:
+            self.append_log_lines(lines)
+        if progress:
+            stage, done_count, total = progress
+            self.progress_bar.set(done_count / total if total else 0)
+            self.files_found_label.configure(text=f"{stage} {done_count} of {total} PDFs")
+        if done:
+            self.set_controls_running(False)
+        else:
+            self.after(EVENT_POLL_INTERVAL_MS, self.drain_events)
+
+    def cancel_rename(self):
+        if self.cancel_event is not None:
+            self.cancel_event.set()
+            self.cancel_button.configure(state="disabled")
+            self.log_message("Cancelling after the files already being read...")
+
+    def set_controls_running(self, running):
+        idle_state = "disabled" if running else "normal"
+        for widget in (self.select_folder_button, self.select_files_button, self.rename_button,
+                       self.workers_menu, self.output_menu, self.use_cache_checkbox):
+            widget.configure(state=idle_state)
+        self.cancel_button.configure(state="normal" if running else "disabled")